@@ -0,0 +1,58 @@
+'''
+Created on October 19, 2026
+
+Benchmark canonicalization of negation heavy schemas.
+oneOf with n branches expands into n allOfs, each of which
+negates the n - 1 other branches.
+
+Usage: python -m benchmarks.bench_negation [repetitions]
+'''
+
+import sys
+import time
+
+import jsonsubschema._checkers as checkers
+from jsonsubschema.api import prepare_operands
+
+
+def oneOf_schema(n):
+    branches = []
+    for i in range(n):
+        if i % 3 == 0:
+            branches.append({"type": "string", "pattern": "^x" + str(i) + "$"})
+        elif i % 3 == 1:
+            branches.append({"type": "integer", "minimum": i, "maximum": i})
+        else:
+            branches.append({"type": "number", "minimum": i * 10})
+    return {"oneOf": branches}
+
+
+def count_constructions():
+    counter = {"nodes": 0}
+    call = checkers.UninhabitedMeta.__call__
+
+    def counting_call(cls, *args, **kwargs):
+        counter["nodes"] += 1
+        return call(cls, *args, **kwargs)
+
+    checkers.UninhabitedMeta.__call__ = counting_call
+    return counter
+
+
+def main():
+    reps = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    counter = count_constructions()
+    print("{:>8} {:>12} {:>12}".format("branches", "nodes", "seconds"))
+    for n in [2, 4, 6, 8]:
+        s = oneOf_schema(n)
+        counter["nodes"] = 0
+        start = time.perf_counter()
+        for _ in range(reps):
+            prepare_operands(s, {})
+        elapsed = (time.perf_counter() - start) / reps
+        print("{:>8} {:>12} {:>12.4f}".format(
+            n, counter["nodes"] // reps, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+'''
+Created on October 19, 2026
+
+Measure the footprint of checker nodes built while running the test corpus,
+and the cost of reading typed fields in the subtype hot paths.
+
+Usage: python -m benchmarks.bench_nodes
+'''
+
+import collections
+import contextlib
+import io
+import sys
+import timeit
+import unittest
+
+import jsonsubschema._checkers as checkers
+
+
+def node_size(node):
+    size = sys.getsizeof(node)
+    if hasattr(node, "__dict__"):
+        size += sys.getsizeof(node.__dict__)
+    return size
+
+
+def record_nodes():
+    sizes = collections.defaultdict(list)
+    call = checkers.UninhabitedMeta.__call__
+
+    def recording_call(cls, *args, **kwargs):
+        obj = call(cls, *args, **kwargs)
+        sizes[cls.__name__].append(node_size(obj))
+        return obj
+
+    checkers.UninhabitedMeta.__call__ = recording_call
+    return sizes
+
+
+def run_test_corpus():
+    suite = unittest.defaultTestLoader.discover("test")
+    with contextlib.redirect_stdout(io.StringIO()):
+        unittest.TextTestRunner(stream=io.StringIO()).run(suite)
+
+
+def attribute_access():
+    s = checkers.JSONTypeString({"minLength": 1, "maxLength": 5})
+    o = checkers.JSONTypeObject({"required": ["a"]})
+    return min(timeit.repeat(
+        "s.minLength; s.maxLength; s.pattern; s.interval; "
+        "o.properties; o.required; o.additionalProperties; o.interval",
+        globals={"s": s, "o": o}, number=200000, repeat=5))
+
+
+def main():
+    sizes = record_nodes()
+    run_test_corpus()
+    total = 0
+    count = 0
+    print("{:>16} {:>8} {:>12}".format("node", "count", "bytes/node"))
+    for name, s in sorted(sizes.items()):
+        total += sum(s)
+        count += len(s)
+        print("{:>16} {:>8} {:>12.1f}".format(name, len(s), sum(s) / len(s)))
+    print("{:>16} {:>8} {:>12.1f}".format("all", count, total / count))
+    print("attribute access (200k x 8 reads): {:.4f}s".format(
+        attribute_access()))
+
+
+if __name__ == "__main__":
+    main()
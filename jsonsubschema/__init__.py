@@ -7,16 +7,43 @@ Created on August 6, 2019
 from jsonsubschema import api
 from jsonsubschema import config
 from jsonsubschema import exceptions
+from jsonsubschema import session
+from jsonsubschema import stats
 from jsonsubschema import _canonicalization
 
 isSubschema = api.isSubschema
+isSubschemaMatrix = api.isSubschemaMatrix
+isSubschemaPairs = api.isSubschemaPairs
 meetSchemas = api.meet
 joinSchemas = api.join
 isEquivalent = api.isEquivalent
+compare = api.compare
+
+aisSubschema = api.aisSubschema
+ameet = api.ameet
+ajoin = api.ajoin
+aisEquivalent = api.aisEquivalent
+acompare = api.acompare
 
 subschemaDecoder = api.JSONSubSchemaFactory
 
-canonicalizeSchema = _canonicalization.canonicalize_schema
+canonicalizeSchema = api.canonicalize
+compile = api.compile_schema
+CompiledSchema = api.CompiledSchema
+SchemaHistory = api.SchemaHistory
+SchemaIndex = api.SchemaIndex
+
+Checker = api.Checker
+Unknown = api.Unknown
 
 set_debug = config.set_debug
 set_warn_uninhabited = config.set_warn_uninhabited
+set_subtype_memo_size = config.set_subtype_memo_size
+set_meet_join_cache_size = config.set_meet_join_cache_size
+set_anyOf_prune_budget = config.set_anyOf_prune_budget
+set_regex_cache_size = config.set_regex_cache_size
+set_negation_cache_size = config.set_negation_cache_size
+set_canonical_cache_size = config.set_canonical_cache_size
+
+get_stats = stats.get_stats
+reset_stats = stats.reset_stats
@@ -4,6 +4,8 @@ Created on June 24, 2019
 '''
 
 import copy
+import hashlib
+import json
 import jsonschema
 import numbers
 import numpy
@@ -14,14 +16,20 @@ import jsonsubschema._utils as utils
 from jsonsubschema._checkers import (
     typeToConstructor,
     boolToConstructor,
+    JSONschema,
     JSONtop,
-    JSONbot
+    JSONbot,
+    negate
 )
+from jsonsubschema._checkpoint import checkpoint
 from jsonsubschema.exceptions import UnexpectedCanonicalization
 
 TOP = {}
 BOT = {"not": {}}
 
+# Reserved keyword carrying the content hash of a canonical schema.
+CANONICAL_MARKER = "$canonical"
+
 
 def canonicalize_schema(obj):
     # First, make sure the given json is a valid json schema.
@@ -38,6 +46,31 @@ def canonicalize_schema(obj):
     return canonical_schema
 
 
+def canonical_digest(s):
+    ''' Content hash of a canonical schema, ignoring the marker itself. '''
+    content = {k: v for k, v in s.items() if k != CANONICAL_MARKER}
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def mark_canonical(s):
+    ''' Return a copy of the canonical schema s tagged with its content hash,
+        so it can be fed back later without being canonicalized again. '''
+    marked = dict(s)
+    marked[CANONICAL_MARKER] = canonical_digest(s)
+    return marked
+
+
+def is_marked_canonical(s):
+    ''' Check that s carries a canonical marker which matches its content. '''
+    if not utils.is_dict(s) or CANONICAL_MARKER not in s:
+        return False
+    return s[CANONICAL_MARKER] == canonical_digest(s)
+
+
+def unmark_canonical(s):
+    return {k: v for k, v in s.items() if k != CANONICAL_MARKER}
+
+
 def canonicalize_dict(d, outer_key=None):
     # not actually needed, but for testing
     # canonicalization to work properly;
@@ -185,6 +218,7 @@ def canonicalize_connectors(d):
                 return canonicalize_dict(d[c].pop())
             anyofs = []
             for i in range(len(d[c])):
+                checkpoint()
                 one = [d[c][i]]
                 nots = [{"not": j} for j in d[c][:i]] + [{"not": j}
                                                          for j in d[c][i+1:]]
@@ -309,6 +343,11 @@ def simplify_schema_and_embed_checkers(s):
     ''' This function assumes the schema s is already canonicalized. 
         So it must be a dict '''
     #
+    # Already embedded, e.g. the result of simplifying allOf
+    # during canonicalization. Checker nodes might be shared
+    # through the meet/join caches, so don't rebuild them in place.
+    if isinstance(s, JSONschema):
+        return s
     if s == {} or not definitions.Jkeywords.intersection(s.keys()):
         top = JSONtop()
         # top.update(s)
@@ -349,7 +388,7 @@ def simplify_schema_and_embed_checkers(s):
         return typeToConstructor.get(s["type"])(s)
 
     if "not" in s:
-        return typeToConstructor.get(s["not"]["type"]).neg(s["not"])
+        return negate(s["not"])
 
     if "anyOf" in s:
         anyofs = [simplify_schema_and_embed_checkers(i) for i in s["anyOf"]]
@@ -4,23 +4,38 @@ Created on June 24, 2019
 '''
 
 import copy
+import functools
+import hashlib
 import json
 import math
 import sys
 
 import intervals as I
-from greenery.lego import parse
 
 import jsonsubschema.config as config
+import jsonsubschema.stats as stats
 
 import jsonsubschema._constants as definitions
 import jsonsubschema._utils as utils
+from jsonsubschema._checkpoint import (
+    checkpoint,
+    checkpointed,
+    count_node
+)
+from jsonsubschema._memo import (
+    current_subtype_memo,
+    join_cache,
+    meet_cache,
+    session_cached
+)
+from jsonsubschema._sketch import Sketch, settled
 from jsonsubschema._utils import print_db
 
 
 class UninhabitedMeta(type):
 
     def __call__(cls, *args, **kwargs):
+        count_node()
         obj = type.__call__(cls, *args, **kwargs)
         obj.updateInternalState()
         obj.isUninhabited()
@@ -28,8 +43,26 @@ class UninhabitedMeta(type):
         return obj
 
 
+class SingletonMeta(UninhabitedMeta):
+    ''' Top and bottom are interned, so that
+        is_top and is_bot can test them by identity. '''
+
+    def __call__(cls):
+        if cls.instance is None:
+            cls.instance = super().__call__()
+        return cls.instance
+
+
 class JSONschema(dict, metaclass=UninhabitedMeta):
 
+    # Nodes are created in large numbers during meet and join,
+    # so keep their typed fields in slots rather than a per-instance dict.
+    # Nodes are still dicts: the dict contents are the JSON view of the
+    # schema, which callers get back and may feed to the API again.
+    # Code setting typed fields directly must call updateView (if the
+    # class has one) to keep that view in sync.
+    __slots__ = ("type", "enum", "_uninhabited", "_digest", "_sketch")
+
     def __init__(self, *args, **kwargs):
 
         super().__init__(*args, **kwargs)
@@ -46,25 +79,60 @@ class JSONschema(dict, metaclass=UninhabitedMeta):
             self.enum = self["enum"]
 
     def updateInternalState(self):
+        # Internal state changed, so forget the cached uninhabited verdict.
+        self._uninhabited = None
+        self._digest = None
+        self._sketch = None
+        self._updateInternalState()
+
+    def _updateInternalState(self):
         pass
 
     def isBoolean(self):
         return self.keys() & definitions.Jconnectors
 
+    def digest(self):
+        ''' Structural hash of the internal state, as opposed to the
+            dict representation, which holds the schema as it was given
+            (e.g. without implied defaults). '''
+        if self._digest is None:
+            self._digest = hashlib.sha1(
+                repr(self._structure()).encode("utf-8")).hexdigest()
+        return self._digest
+
+    def _structure(self):
+        enum = json.dumps(self.enum, sort_keys=True) if self.hasEnum() else None
+        return (self.type, enum)
+
     def hasEnum(self):
         return "enum" in self.keys() or hasattr(self, "enum")
 
-    def isUninhabited(self):
-        # Don't store uninhabited key,
-        # but rather re-check on the fly to
-        # get an updated results based on the
-        # current internal state.
-        uninhabited = self._isUninhabited()  # and (
-        # "enum" in self and not self["enum"])
-        if config.WARN_UNINHABITED and uninhabited:
-            print("Found an uninhabited type at: ", type(self), self)
-        return uninhabited
+    def typeMask(self):
+        ''' Bits of the json types this schema may validate. '''
+        return definitions.JtypesToBits[self.type]
+
+    def isIdentical(self, s):
+        ''' Structural equality of the internal state, by digest. '''
+        return self is s or (isinstance(s, JSONschema) and self.digest() == s.digest())
 
+    def sketch(self):
+        if self._sketch is None:
+            self._sketch = Sketch(self)
+        return self._sketch
+
+    def isUninhabited(self):
+        # Don't store uninhabited key in the schema,
+        # but cache the verdict until the internal state
+        # changes. See updateInternalState().
+        if self._uninhabited is None:
+            stats.count("uninhabited_computed")
+            self._uninhabited = self._isUninhabited()  # and (
+            # "enum" in self and not self["enum"])
+            if config.current().WARN_UNINHABITED and self._uninhabited:
+                print("Found an uninhabited type at: ", type(self), self)
+        return self._uninhabited
+
+    @checkpointed
     def meet(self, s):
         #
         # if self == s or is_top(s):
@@ -77,7 +145,25 @@ class JSONschema(dict, metaclass=UninhabitedMeta):
         if is_bot(self) or is_bot(s):
             return JSONbot()
         #
+        if self.isIdentical(s):
+            stats.count("identical_pairs")
+            return self
+        #
+        if not self.sketch().mayMeet(s.sketch()):
+            return settled(JSONbot())
+        #
+        # Results are shared through the cache,
+        # so they must never be modified in place.
+        cache = meet_cache()
+        if cache is not None:
+            key = (self.digest(), s.digest())
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+        #
         ret = self._meet(s)
+        if cache is not None:
+            cache.put(key, ret)
         #
         # if self.hasEnum() or s.hasEnum():
         #     enum = JSONschema.meet_enum(self, s)
@@ -114,6 +200,7 @@ class JSONschema(dict, metaclass=UninhabitedMeta):
         # print("Eww! Using abstract _join :: running into corner case!")
         return JSONanyOf(ret)
 
+    @checkpointed
     def join(self, s):
         #
         # if self == s or is_bot(s):
@@ -126,17 +213,35 @@ class JSONschema(dict, metaclass=UninhabitedMeta):
         if is_top(self) or is_top(s):
             return JSONtop()
         #
+        if self.isIdentical(s):
+            stats.count("identical_pairs")
+            return self
+        #
+        # Results are shared through the cache,
+        # so they must never be modified in place.
+        cache = join_cache()
+        if cache is not None:
+            key = (self.digest(), s.digest())
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+        #
         ret = self._join(s)
         #
         if self.hasEnum() and s.hasEnum():
             enum = JSONschema.join_enum(self, s)
             if enum:
+                # _join might return a shared node.
+                ret = copy.copy(ret)
                 ret.enum = ret["enum"] = list(enum)
+                ret._digest = None
+                ret._sketch = None
         # instead of returning uninhabited types, return bot
         if is_bot(ret):
-            return JSONbot()
-        else:
-            return ret
+            ret = JSONbot()
+        if cache is not None:
+            cache.put(key, ret)
+        return ret
 
     @staticmethod
     def join_enum(s1, s2):
@@ -146,6 +251,14 @@ class JSONschema(dict, metaclass=UninhabitedMeta):
             except:
                 return s1.enum + s2.enum
 
+    @staticmethod
+    def join_all(schemas):
+        ''' Join a list of schemas of the same type at once.
+            Returns the list of schemas making up their union.
+            By default, schemas of a type are kept as separate branches. '''
+        return list(schemas)
+
+    @checkpointed
     def isSubtype(self, s):
         #
         # if self == s or is_bot(self) or is_top(s):
@@ -156,7 +269,24 @@ class JSONschema(dict, metaclass=UninhabitedMeta):
                 or (is_top(self) and not is_top(s)):
             return False
         #
-        return self.subtype_enum(s) and self._isSubtype(s)
+        if self.isIdentical(s):
+            stats.count("identical_pairs")
+            return True
+        #
+        if not self.sketch().mayBeSubtype(s.sketch()):
+            return settled(False)
+        #
+        memo = current_subtype_memo()
+        if memo is None:
+            return self.subtype_enum(s) and self._isSubtype(s)
+        #
+        key = (self.digest(), s.digest())
+        entry = memo.get(key)
+        if entry is not None:
+            return entry[0]
+        ret = self.subtype_enum(s) and self._isSubtype(s)
+        memo.put(key, ret)
+        return ret
 
     def isSubtype_nonTrivial(self, s):
         return self._isSubtype_nonTrivial(s)
@@ -178,7 +308,11 @@ class JSONschema(dict, metaclass=UninhabitedMeta):
         if s.isBoolean():
             if s.type == "anyOf":
                 if not s.nonTrivialJoin:
-                    return any(isSubtype_cb(self, i) for i in s.anyOf)
+                    branches = s.subtypeCandidatesFor(self)
+                    if any(self.isIdentical(i) for i in branches):
+                        stats.count("identical_pairs")
+                        return True
+                    return any(isSubtype_cb(self, i) for i in branches)
                 else:
                     return self.isSubtype_nonTrivial(s)
 
@@ -194,14 +328,29 @@ class JSONschema(dict, metaclass=UninhabitedMeta):
         return isSubtype_cb(self, s)
 
 
-class JSONtop(JSONschema):
+class JSONtop(JSONschema, metaclass=SingletonMeta):
+    __slots__ = ()
+    instance = None
+
     def __init__(self):
         super().__init__({})
         self.type = "top"
 
+    def __reduce__(self):
+        return (JSONtop, ())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
     def _isUninhabited(self):
         return False
 
+    def typeMask(self):
+        return definitions.JtypesAllBits
+
     def _meet(self, s):
         return s
 
@@ -231,17 +380,36 @@ class JSONtop(JSONschema):
 
 
 def is_top(obj):
-    return obj == True or obj == {} or isinstance(obj, JSONtop)
+    if obj is True or obj is JSONtop.instance:
+        return True
+    if obj is False or isinstance(obj, JSONschema):
+        return False
+    return obj == {}
 
 
-class JSONbot(JSONschema):
+class JSONbot(JSONschema, metaclass=SingletonMeta):
+    __slots__ = ()
+    instance = None
+
     def __init__(self):
         super().__init__({"not": {}})
         self.type = "bot"
 
+    def __reduce__(self):
+        return (JSONbot, ())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
     def _isUninhabited(self):
         return True
 
+    def typeMask(self):
+        return 0
+
     def _meet(self, s):
         return self
 
@@ -270,15 +438,30 @@ class JSONbot(JSONschema):
         return False
 
 
+def structure_of(obj):
+    ''' Structural representation of a keyword value which may hold
+        subschemas, for use in JSONschema._structure(). '''
+    if isinstance(obj, JSONschema):
+        return obj.digest()
+    if utils.is_list(obj):
+        return tuple(structure_of(i) for i in obj)
+    return obj
+
+
 def is_bot(obj):
-    return obj == False \
-        or (utils.is_dict(obj) and obj.get("not") == {}) \
-        or isinstance(obj, JSONbot) \
-        or (isinstance(obj, JSONschema) and obj.isUninhabited())
+    if obj is False or obj is JSONbot.instance:
+        return True
+    if obj is True:
+        return False
+    if isinstance(obj, JSONschema):
+        return obj.isUninhabited()
+    return utils.is_dict(obj) and obj.get("not") == {}
 
 
 class JSONTypeString(JSONschema):
 
+    __slots__ = ("minLength", "maxLength", "pattern", "interval")
+
     def __init__(self, s):
         super().__init__(s)
         self.type = self["type"] = "string"
@@ -293,13 +476,16 @@ class JSONTypeString(JSONschema):
         else:
             self.pattern = ""
 
+    def _structure(self):
+        return super()._structure() + (self.minLength, self.maxLength, self.pattern)
+
     def _isUninhabited(self):
         return (self.minLength > self.maxLength)
         # or self.pattern == None
-        # See comment below at updateInternalState()
+        # See comment below at _updateInternalState()
         # or self.range_with_pattern == None
 
-    def updateInternalState(self):
+    def _updateInternalState(self):
         self.interval = I.closed(self.minLength, self.maxLength)
         #
         # Should be done here to check for uninhabited string schema
@@ -395,6 +581,33 @@ class JSONTypeString(JSONschema):
 
         return super().isSubtype_handle_rhs(s, _isStringSubtype)
 
+    @staticmethod
+    def join_all(schemas):
+        ''' n-ary version of _joinString:
+            one string schema whose pattern is the alternation of all
+            patterns, each restricted to its length range. '''
+        if len(schemas) == 1:
+            return list(schemas)
+        ret = {}
+        mn = min(s.minLength for s in schemas)
+        if utils.is_num(mn):
+            ret["minLength"] = mn
+        mx = max(s.maxLength for s in schemas)
+        if utils.is_num(mx):
+            ret["maxLength"] = mx
+        patterns = []
+        for s in schemas:
+            s_range = utils.string_range_to_regex(s.minLength, s.maxLength)
+            s_new_pattern = utils.regex_meet(s_range, s.pattern)
+            if s_new_pattern:
+                patterns.append("^" + s_new_pattern + "$")
+        if patterns:
+            ret["pattern"] = "|".join(patterns)
+        enum = join_all_enums(schemas)
+        if enum:
+            ret["enum"] = enum
+        return [JSONTypeString(ret)]
+
     @staticmethod
     def neg(s):
         negated_strings = []
@@ -425,6 +638,9 @@ class JSONTypeString(JSONschema):
 
 class JSONTypeNumeric(JSONschema):
 
+    __slots__ = ("minimum", "maximum", "exclusiveMinimum",
+                 "exclusiveMaximum", "multipleOf", "interval")
+
     def __init__(self, s):
         super().__init__(s)
         self.minimum = self.get("minimum", -I.inf)
@@ -433,11 +649,15 @@ class JSONTypeNumeric(JSONschema):
         self.exclusiveMaximum = self.get("exclusiveMaximum", False)
         self.multipleOf = self.get("multipleOf", None)
 
+    def _structure(self):
+        return super()._structure() + (self.minimum, self.maximum, self.exclusiveMinimum,
+                                       self.exclusiveMaximum, self.multipleOf)
+
     def _isUninhabited(self):
         return self.interval.is_empty()  \
             or utils.is_num(self.multipleOf) and self.multipleOf > self.maximum
 
-    def updateInternalState(self):
+    def _updateInternalState(self):
         self.build_interval_draft4()
 
     def _meet(self, s):
@@ -475,6 +695,8 @@ class JSONTypeNumeric(JSONschema):
 
 class JSONTypeInteger(JSONTypeNumeric):
 
+    __slots__ = ()
+
     def __init__(self, s):
         super().__init__(s)
         self.type = self["type"] = "integer"
@@ -588,6 +810,7 @@ class JSONTypeInteger(JSONTypeNumeric):
 
             mulof = [self.multipleOf] if self.multipleOf else []
             for x in utils.generate_range_with_multipleof(range(self.minimum, self.maximum+1), mulof, []):
+                checkpoint()
                 for interv, m in interval_to_mulofs.items():
                     if x in interv:
                         if m:
@@ -600,6 +823,20 @@ class JSONTypeInteger(JSONTypeNumeric):
 
             return True
 
+    @staticmethod
+    def join_all(schemas):
+        ''' Integer schemas without multipleOf form an interval set:
+            sort them and merge adjacent or overlapping intervals in one sweep.
+            Like _joinInteger, schemas with multipleOf are kept apart. '''
+        merged = []
+        for s in sorted((s for s in schemas if not s.multipleOf),
+                        key=lambda s: s.interval.lower):
+            if merged and utils.are_intervals_mergable(merged[-1].interval, s.interval):
+                merged[-1] = merged[-1].join(s)
+            else:
+                merged.append(s)
+        return merged + [s for s in schemas if s.multipleOf]
+
     @staticmethod
     def neg(s):
         negated_ints = []
@@ -630,6 +867,8 @@ class JSONTypeInteger(JSONTypeNumeric):
 
 class JSONTypeNumber(JSONTypeNumeric):
 
+    __slots__ = ()
+
     def __init__(self, s):
         super().__init__(s)
         self.type = self["type"] = "number"
@@ -708,6 +947,20 @@ class JSONTypeNumber(JSONTypeNumeric):
 
         return super().isSubtype_handle_rhs(s, _isNumberSubtype)
 
+    @staticmethod
+    def join_all(schemas):
+        ''' Sort number schemas by lower bound and merge
+            overlapping intervals in one sweep, as in _joinNumber. '''
+        merged = []
+        for s in sorted(schemas, key=lambda s: s.interval.lower):
+            if merged and merged[-1].interval.overlaps(s.interval):
+                joined = merged[-1].join(s)
+                if joined.type == "number":
+                    merged[-1] = joined
+                    continue
+            merged.append(s)
+        return merged
+
     @staticmethod
     def neg(s):
         negated_numbers = []
@@ -740,6 +993,8 @@ class JSONTypeNumber(JSONTypeNumeric):
 
 class JSONTypeBoolean(JSONschema):
 
+    __slots__ = ()
+
     def __init__(self, s):
         super().__init__(s)
         self.type = self["type"] = "boolean"
@@ -781,6 +1036,15 @@ class JSONTypeBoolean(JSONschema):
 
         return super().isSubtype_handle_rhs(s, _isBooleanSubtype)
 
+    @staticmethod
+    def join_all(schemas):
+        if len(schemas) == 1:
+            return list(schemas)
+        enum = join_all_enums(schemas)
+        if enum:
+            return [JSONTypeBoolean({"enum": enum})]
+        return [JSONTypeBoolean({})]
+
     @staticmethod
     def neg(s):
         negated_boolean = []
@@ -799,6 +1063,8 @@ class JSONTypeBoolean(JSONschema):
 
 class JSONTypeNull(JSONschema):
 
+    __slots__ = ()
+
     def __init__(self, s):
         super().__init__(s)
         self.type = self["type"] = "null"
@@ -827,6 +1093,10 @@ class JSONTypeNull(JSONschema):
 
         return super().isSubtype_handle_rhs(s, _isNullSubtype)
 
+    @staticmethod
+    def join_all(schemas):
+        return [schemas[0]]
+
     @staticmethod
     def neg(s):
         return boolToConstructor.get("anyOf")(
@@ -835,6 +1105,9 @@ class JSONTypeNull(JSONschema):
 
 class JSONTypeArray(JSONschema):
 
+    __slots__ = ("minItems", "maxItems", "items_",
+                 "additionalItems", "uniqueItems", "interval")
+
     def __init__(self, s):
         super().__init__(s)
         self.type = self["type"] = "array"
@@ -844,19 +1117,42 @@ class JSONTypeArray(JSONschema):
         self.additionalItems = self.get("additionalItems", True)
         self.uniqueItems = self.get("uniqueItems", False)
 
+    def updateView(self):
+        ''' Write the typed fields back to the dict view,
+            after they were set directly, e.g. by meet. '''
+        view = {"type": "array"}
+        if self.minItems:
+            view["minItems"] = self.minItems
+        if utils.is_num(self.maxItems):
+            view["maxItems"] = self.maxItems
+        if not is_top(self.items_):
+            view["items"] = self.items_
+        if self.additionalItems is not True:
+            view["additionalItems"] = self.additionalItems
+        if self.uniqueItems:
+            view["uniqueItems"] = True
+        if self.hasEnum():
+            view["enum"] = self.enum
+        self.clear()
+        self.update(view)
+
     def compute_actual_maxItems(self):
         if utils.is_list(self.items_) and is_bot(self.additionalItems):
             new_max = min(self.maxItems, len(self.items_))
             if new_max != self.maxItems:
                 self.maxItems = new_max
 
+    def _structure(self):
+        return super()._structure() + (self.minItems, self.maxItems, structure_of(self.items_),
+                                       structure_of(self.additionalItems), self.uniqueItems)
+
     def _isUninhabited(self):
         return (self.minItems > self.maxItems) or \
             (utils.is_list(self.items_) and self.additionalItems ==
              False and self.minItems > len(self.items_)) or \
             (utils.is_list(self.items_) and len(self.items_) == 0)
 
-    def updateInternalState(self):
+    def _updateInternalState(self):
         self.compute_actual_maxItems()
         self.interval = I.closed(self.minItems, self.maxItems)
         if utils.is_list(self.items_) and len(self.items_) == self.maxItems:
@@ -904,7 +1200,7 @@ class JSONTypeArray(JSONschema):
                 if utils.is_dict(s1.items_):
 
                     if utils.is_dict(s2.items_):
-                        ret.items = s1.items_.meet(s2.items_)
+                        ret.items_ = s1.items_.meet(s2.items_)
 
                     elif utils.is_list(s2.items_):
                         ret = meet_arrayItems_dict_list(s1, s2, ret)
@@ -978,6 +1274,7 @@ class JSONTypeArray(JSONschema):
 
                         elif self_len < s_len:
                             ret = meet_array_longlist_shorterlist(s2, s1, ret)
+                ret.updateView()
                 ret.updateInternalState()
                 return ret
 
@@ -1126,6 +1423,10 @@ class JSONTypeArray(JSONschema):
 
 class JSONTypeObject(JSONschema):
 
+    __slots__ = ("properties", "additionalProperties", "required",
+                 "minProperties", "maxProperties", "patternProperties", "interval",
+                 "_propertyNames", "_requiredKeys", "_keyPatterns")
+
     def __init__(self, s):
         super().__init__(s)
         self.type = self["type"] = "object"
@@ -1139,6 +1440,29 @@ class JSONTypeObject(JSONschema):
             for k, v in self["patternProperties"].items():
                 self.patternProperties[utils.regex_unanchor(k)] = v
 
+    def updateView(self):
+        ''' Write the typed fields back to the dict view,
+            after they were set directly, e.g. by meet. '''
+        view = {"type": "object"}
+        if self.properties:
+            view["properties"] = self.properties
+        if self.patternProperties:
+            # The keys were unanchored by the constructor; see utils.regex_unanchor.
+            view["patternProperties"] = dict(("^" + k + "$", v)
+                                             for k, v in self.patternProperties.items())
+        if not is_top(self.additionalProperties):
+            view["additionalProperties"] = self.additionalProperties
+        if self.required:
+            view["required"] = sorted(set(self.required))
+        if self.minProperties:
+            view["minProperties"] = self.minProperties
+        if utils.is_num(self.maxProperties):
+            view["maxProperties"] = self.maxProperties
+        if self.hasEnum():
+            view["enum"] = self.enum
+        self.clear()
+        self.update(view)
+
     def compute_actual_min_max_Properties(self):
 
         new_min = max(self.minProperties, len(self.required))
@@ -1150,6 +1474,53 @@ class JSONTypeObject(JSONschema):
         #     if new_max != self.maxProperties:
         #         self.maxProperties = new_max
 
+    def _structure(self):
+        return super()._structure() + (
+            self.minProperties, self.maxProperties, tuple(sorted(set(self.required))),
+            tuple(sorted((k, structure_of(v)) for k, v in self.properties.items())),
+            tuple(sorted((k, structure_of(v))
+                         for k, v in self.patternProperties.items())),
+            structure_of(self.additionalProperties))
+
+    def propertyNames(self):
+        if self._propertyNames is None:
+            self._propertyNames = frozenset(self.properties)
+        return self._propertyNames
+
+    def requiredKeys(self):
+        if self._requiredKeys is None:
+            self._requiredKeys = frozenset(self.required)
+        return self._requiredKeys
+
+    def patternsFor(self, k):
+        ''' patternProperties patterns matching the concrete key k,
+            cached per key since matching a regex is expensive. '''
+        ret = self._keyPatterns.get(k)
+        if ret is None:
+            ret = self._keyPatterns[k] = [k_ for k_ in self.patternProperties.keys()
+                                          if utils.regex_matches_string(k_, k)]
+        return ret
+
+    def schemasForKey(self, k):
+        ''' Searches for matching key and get the corresponding schema(s).
+            Returns iterable because if a key matches more than one pattern, 
+            that key schema has to match all corresponding patterns schemas.
+        '''
+        if k in self.properties:
+            return [self.properties[k]]
+        # in case a key has to be checked against patternProperties,
+        # it has to adhere to all schemas which have pattern matching the key.
+        return [self.patternProperties[k_] for k_ in self.patternsFor(k)] \
+            or [self.additionalProperties]
+
+    def patternInclusions(self, s):
+        ''' Pairs of patterns (k, k_) from self and s resp. where k
+            is a subset of k_, computed for all patterns at once. '''
+        if not self.patternProperties or not s.patternProperties:
+            return frozenset()
+        return utils.regex_inclusions(tuple(self.patternProperties),
+                                      tuple(s.patternProperties))
+
     def _isUninhabited(self):
 
         def required_is_uninhabited(s):
@@ -1158,15 +1529,10 @@ class JSONTypeObject(JSONschema):
             if s.additionalProperties:
                 return False
 
-            for k in s.required:
-                if not k in s.properties.keys():
-                    for k_ in s.patternProperties.keys():
-                        if utils.regex_matches_string(k_, k):
-                            break
-                    else:
-                        # here, inner loop finished and key was not found;
-                        # so it is uninhabited because a required key is not allowed
-                        return True
+            for k in s.requiredKeys():
+                if not k in s.properties and not s.patternsFor(k):
+                    # so it is uninhabited because a required key is not allowed
+                    return True
 
             return False
 
@@ -1174,7 +1540,10 @@ class JSONTypeObject(JSONschema):
             or len(self.required) > self.maxProperties \
             or required_is_uninhabited(self)
 
-    def updateInternalState(self):
+    def _updateInternalState(self):
+        self._propertyNames = None
+        self._requiredKeys = None
+        self._keyPatterns = {}
         self.compute_actual_min_max_Properties()
         self.interval = I.closed(self.minProperties, self.maxProperties)
         if len(self.properties) == self.maxProperties \
@@ -1196,7 +1565,7 @@ class JSONTypeObject(JSONschema):
         def _meetObject(s1, s2):
             if s2.type == "object":
                 ret = JSONTypeObject({})
-                ret.required = list(set(s1.required).union(s2.required))
+                ret.required = list(s1.requiredKeys() | s2.requiredKeys())
                 ret.minProperties = max(s1.minProperties, s2.minProperties)
                 ret.maxProperties = min(s1.maxProperties, s2.maxProperties)
                 #
@@ -1217,15 +1586,10 @@ class JSONTypeObject(JSONschema):
                 # For efficiency, we just include all key in properties and patternProperties of both schemas.
                 # We only have to handle exactly matching keys in both properties and patternProperties.
                 #
-                properties = {}
-                for k in s1.properties.keys():
-                    if k in s2.properties.keys():
-                        properties[k] = s1.properties[k].meet(s2.properties[k])
-                    else:
-                        properties[k] = s1.properties[k]
-                for k in s2.properties.keys():
-                    if k not in s1.properties.keys():
-                        properties[k] = s2.properties[k]
+                properties = dict(s1.properties)
+                properties.update(s2.properties)
+                for k in s1.propertyNames() & s2.propertyNames():
+                    properties[k] = s1.properties[k].meet(s2.properties[k])
                 ret.properties = properties
                 #
                 pProperties = {}
@@ -1240,6 +1604,7 @@ class JSONTypeObject(JSONschema):
                         pProperties[k] = s2.patternProperties[k]
                 ret.patternProperties = pProperties
                 #
+                ret.updateView()
                 ret.updateInternalState()
                 return ret
             else:
@@ -1286,28 +1651,9 @@ class JSONTypeObject(JSONschema):
             #         return True
             # #
 
-            def get_schema_for_key(k, s):
-                ''' Searches for matching key and get the corresponding schema(s).
-                    Returns iterable because if a key matches more than one pattern, 
-                    that key schema has to match all corresponding patterns schemas.
-                '''
-                if k in s.properties.keys():
-                    return [s.properties[k]]
-                else:
-                    ret = []
-                    for k_ in s.patternProperties.keys():
-                        if utils.regex_matches_string(k_, k):
-                            # in case a key has to be checked against patternProperties,
-                            # it has to adhere to all schemas which have pattern matching the key.
-                            ret.append(s.patternProperties[k_])
-                    if ret:
-                        return ret
-
-                return [s.additionalProperties]
-
             # Check that required keys satisfy subtyping.
             # lhs required keys should be superset of rhs required keys.
-            if not set(s1.required).issuperset(s2.required):
+            if not s1.requiredKeys().issuperset(s2.requiredKeys()):
                 print_db("__02__")
                 return False
             # If required keys are properly defined, check their corresponding
@@ -1316,9 +1662,9 @@ class JSONTypeObject(JSONschema):
             # have an explicit schema defined by the json object.
 
             else:
-                for k in set(s1.required).intersection(s2.required):
-                    for lhs_ in get_schema_for_key(k, s1):
-                        for rhs_ in get_schema_for_key(k, s2):
+                for k in s1.requiredKeys() & s2.requiredKeys():
+                    for lhs_ in s1.schemasForKey(k):
+                        for rhs_ in s2.schemasForKey(k):
                             if lhs_:
                                 if rhs_:
                                     if not lhs_.isSubtype(rhs_):
@@ -1329,12 +1675,8 @@ class JSONTypeObject(JSONschema):
                                     print_db("__04__")
                                     return False
 
-            extra_keys_on_rhs = set(s2.properties.keys()).difference(
-                s1.properties.keys())
-            for k in extra_keys_on_rhs.copy():
-                for k_ in s1.patternProperties.keys():
-                    if utils.regex_matches_string(k_, k):
-                        extra_keys_on_rhs.remove(k)
+            extra_keys_on_rhs = [k for k in s2.propertyNames() - s1.propertyNames()
+                                 if not s1.patternsFor(k)]
             # if extra_keys_on_rhs:
                 # if not s1.additionalProperties:
                 #     print_db("?__05__")
@@ -1356,12 +1698,12 @@ class JSONTypeObject(JSONschema):
                     #     print_db("__06__")
                     #     return False
 
-            extra_patterns_on_rhs = set(s2.patternProperties.keys()).difference(
-                s1.patternProperties.keys())
-            for k in extra_patterns_on_rhs.copy():
-                for k_ in s1.patternProperties.keys():
-                    if utils.regex_isSubset(k, k_):
-                        extra_patterns_on_rhs.remove(k)
+            # rhs patterns which are subsets of lhs patterns.
+            contained = s2.patternInclusions(s1)
+            extra_patterns_on_rhs = [k for k in s2.patternProperties.keys()
+                                     if k not in s1.patternProperties
+                                     and not any((k, k_) in contained
+                                                 for k_ in s1.patternProperties.keys())]
             if extra_patterns_on_rhs:
                 if not s1.additionalProperties:
                     print_db("__07__")
@@ -1369,9 +1711,7 @@ class JSONTypeObject(JSONschema):
                 else:
                     for k in extra_patterns_on_rhs:
                         if not s1.additionalProperties.isSubtype(s2.patternProperties[k]):
-                            try:  # means regex k is infinite
-                                parse(k).cardinality()
-                            except OverflowError:
+                            if utils.regex_is_infinite(k):
                                 print_db("__08__")
                                 return False
             #
@@ -1392,27 +1732,25 @@ class JSONTypeObject(JSONschema):
                             # p.cardinality
 
             # first, matching properties should be subtype pairwise
-            unmatched_lhs_props_keys = set(s1.properties.keys())
-            for k in s1.properties.keys():
-                if k in s2.properties.keys():
-                    unmatched_lhs_props_keys.discard(k)
-                    if not s1.properties[k].isSubtype(s2.properties[k]):
+            for k in s1.propertyNames() & s2.propertyNames():
+                if not s1.properties[k].isSubtype(s2.properties[k]):
+                    return False
+            # for the remaining keys, make sure they either don't exist
+            # in rhs or if they, then their schemas should be sub-type
+            unmatched_lhs_props_keys = set()
+            for k in s1.propertyNames() - s2.propertyNames():
+                patterns = s2.patternsFor(k)
+                if not patterns:
+                    unmatched_lhs_props_keys.add(k)
+                for k_ in patterns:
+                    if not s1.properties[k].isSubtype(s2.patternProperties[k_]):
                         return False
-                # for the remaining keys, make sure they either don't exist
-                # in rhs or if they, then their schemas should be sub-type
-                else:
-                    for k_ in s2.patternProperties:
-                        # if utils.regex_isSubset(k, k_):
-                        if utils.regex_matches_string(k_, k):
-                            unmatched_lhs_props_keys.discard(k)
-                            if not s1.properties[k].isSubtype(s2.patternProperties[k_]):
-                                return False
 
             # second, matching patternProperties should be subtype pairwise
             unmatched_lhs_pProps_keys = set(s1.patternProperties.keys())
             for k in s1.patternProperties.keys():
                 for k_ in s2.patternProperties.keys():
-                    if utils.regex_isSubset(k_, k):
+                    if (k_, k) in contained:
                         unmatched_lhs_pProps_keys.discard(k)
                         if not s1.patternProperties[k].isSubtype(s2.patternProperties[k_]):
                             return False
@@ -1454,15 +1792,169 @@ class JSONTypeObject(JSONschema):
 
 
 def JSONanyOfFactory(s):
-    ret = JSONbot()
+    ''' Join all schemas in s["anyOf"].
+        Nested anyOfs are flattened and the schemas are bucketed by type
+        in one pass; then each bucket is merged at once by join_all
+        of its type, rather than folding pairwise joins over all schemas. '''
+    buckets = {}
     for i in s.get("anyOf"):
-        ret = ret.join(i)
+        if is_top(i):
+            return JSONtop()
+        for j in (i.anyOf if i.type == "anyOf" else [i]):
+            if not is_bot(j):
+                buckets.setdefault(j.type, []).append(j)
+
+    anyofs = []
+    for schemas in buckets.values():
+        anyofs.extend(schemas[0].join_all(schemas))
+    anyofs = prune_anyOf(anyofs)
+
+    if len(anyofs) == 0:
+        return JSONbot()
+    elif len(anyofs) == 1:
+        return anyofs[0]
+    ret = JSONanyOf({"anyOf": anyofs})
+    ret.nonTrivialJoin = is_nonTrivial_integer_join(anyofs)
+    return ret
+
+
+def prune_anyOf(anyofs):
+    ''' Drop duplicate branches of an anyOf by structural digest.
+        If enabled by config.set_anyOf_prune_budget, also drop branches
+        which are subtypes of a sibling, trying at most that many subtype
+        checks between branches of the same type whose subtype checks
+        are exact; see is_exactly_checkable. '''
+    seen = set()
+    unique = []
+    for i in anyofs:
+        if i.digest() not in seen:
+            seen.add(i.digest())
+            unique.append(i)
+    if len(unique) < len(anyofs):
+        stats.count("anyOf_deduplicated", len(anyofs) - len(unique))
+
+    budget = config.current().ANYOF_PRUNE_BUDGET
+    if not budget or len(unique) < 2:
+        return unique
+
+    exact = set(id(i) for i in unique if is_exactly_checkable(i))
+    kept = []
+    for i in unique:
+        if budget <= 0 or id(i) not in exact:
+            kept.append(i)
+            continue
+        candidates = [k for k in kept if k.type == i.type and id(k) in exact]
+        budget -= len(candidates)
+        if any(i.isSubtype(k) for k in candidates):
+            stats.count("anyOf_pruned")
+            continue
+        budget -= len(candidates)
+        subsumed = [k for k in candidates if k.isSubtype(i)]
+        if subsumed:
+            stats.count("anyOf_pruned", len(subsumed))
+            kept = [k for k in kept if not any(k is j for j in subsumed)]
+        kept.append(i)
+    return kept
+
+
+def is_exactly_checkable(s):
+    ''' Whether the subtype checks of s against schemas alike are known
+        to be exact. Some subtype checks may answer True for schemas which
+        are not subtypes, e.g. when enums are involved, so only the simplest
+        schemas are trusted: numerics without multipleOf, strings without
+        pattern, booleans, nulls, and objects and arrays of those, all
+        without enum, and objects without patternProperties or a schema
+        for additionalProperties. '''
+    if utils.is_bool(s) or is_top(s) or is_bot(s):
+        return True
+    if s.hasEnum():
+        return False
+    if s.type in definitions.Jnumeric:
+        return s.multipleOf is None
+    if s.type == "string":
+        return not s.pattern
+    if s.type == "object":
+        # Extra keys of the RHS are only checked against a bool, top
+        # or bot additionalProperties of the LHS, not against a schema.
+        ap = s.additionalProperties
+        return not s.patternProperties \
+            and all(is_exactly_checkable(i) for i in s.properties.values()) \
+            and (utils.is_bool(ap) or is_top(ap) or is_bot(ap))
+    if s.type == "array":
+        items = s.items_ if utils.is_list(s.items_) else [s.items_]
+        return not s.uniqueItems \
+            and all(is_exactly_checkable(i) for i in items) \
+            and is_exactly_checkable(s.additionalItems)
+    return s.type in ("boolean", "null")
+
+
+def join_all_enums(schemas):
+    ''' n-ary version of JSONschema.join_enum;
+        only defined if every schema has an enum. '''
+    if all(s.hasEnum() for s in schemas):
+        try:
+            return sorted(set().union(*(s.enum for s in schemas)))
+        except:
+            enum = []
+            for s in schemas:
+                enum.extend(i for i in s.enum if i not in enum)
+            return enum
+
+
+def is_nonTrivial_integer_join(anyofs):
+    ''' As in JSONTypeInteger._join, a union of integer schemas where one
+        with multipleOf and a finite range is mergable with another needs
+        the enumerative subtype check. '''
+    if not all(i.type == "integer" for i in anyofs):
+        return False
+    for i in anyofs:
+        if i.multipleOf and utils.is_interval_finite(i.interval):
+            for j in anyofs:
+                if j is not i and utils.are_intervals_mergable(i.interval, j.interval):
+                    return True
+    return False
+
 
+def singleton_value(s):
+    ''' The only value valid against the (inhabited) schema s,
+        tagged by its json type so that e.g. 1 and "1" differ,
+        or None if s is not known to have exactly one value. '''
+    if not isinstance(s, JSONschema) or is_bot(s):
+        return None
+    if s.type in ["string", "boolean"]:
+        if s.hasEnum() and len(s.enum) == 1:
+            return (s.type, s.enum[0])
+    elif s.type in definitions.Jnumeric:
+        if not s.interval.is_empty() and s.interval.lower == s.interval.upper:
+            return ("number", s.interval.lower)
+    elif s.type == "null":
+        return ("null", None)
+    return None
+
+
+def fixed_property(s, k):
+    ''' The single value of the property k of the object schema s,
+        as in singleton_value, if k is required and fixed; None otherwise. '''
+    if k in s.requiredKeys() and k in s.properties:
+        return singleton_value(s.properties[k])
+    return None
+
+
+def fixed_properties(s):
+    ''' Map from the required properties of the object schema s
+        which are fixed to a single value, to that value. '''
+    ret = {}
+    for k in s.requiredKeys():
+        v = fixed_property(s, k)
+        if v is not None:
+            ret[k] = v
     return ret
 
 
 class JSONanyOf(JSONschema):
 
+    __slots__ = ("anyOf", "nonTrivialJoin", "_index", "_discriminator")
+
     def __init__(self, s):
         super().__init__(s)
         self.type = "anyOf"
@@ -1480,15 +1972,90 @@ class JSONanyOf(JSONschema):
     #     else:
     #         return super().__eq__(other)
 
-    def updateInternalState(self):
-        for d_i in self.anyOf:
-            if "anyOf" in d_i.keys():
-                self.anyOf.extend(d_i.get("anyOf"))
-                self.anyOf.remove(d_i)
+    def _updateInternalState(self):
+        self._index = None
+        self._discriminator = None
+        # Flatten nested anyOfs in one pass,
+        # without modifying the list we were given.
+        if any("anyOf" in d_i.keys() for d_i in self.anyOf):
+            anyofs = []
+            for d_i in self.anyOf:
+                if "anyOf" in d_i.keys():
+                    anyofs.extend(d_i.get("anyOf"))
+                else:
+                    anyofs.append(d_i)
+            self.anyOf = self["anyOf"] = anyofs
+
+    def _structure(self):
+        return super()._structure() + (tuple(i.digest() for i in self.anyOf), self.nonTrivialJoin)
 
     def _isUninhabited(self):
         return all(is_bot(i) for i in self.anyOf)
 
+    def typeMask(self):
+        return functools.reduce(
+            lambda m, i: m if is_bot(i) else m | i.typeMask(), self.anyOf, 0)
+
+    def branchesFor(self, s):
+        ''' Branches which might be related to the non-anyOf schema s.
+            Subtype and meet of schemas of different types are trivially
+            False and bot, except for integer and number; so index
+            branches by the types they can relate to. '''
+        # Nodes may be shared by threads, so only publish
+        # the index once it is complete.
+        index = self._index
+        if index is None:
+            index = {}
+            for i in self.anyOf:
+                if i.type == "top":
+                    # related to everything, don't bother indexing.
+                    index = False
+                    break
+                related = definitions.Jnumeric if i.type in definitions.Jnumeric else [i.type]
+                for t in related:
+                    index.setdefault(t, []).append(i)
+            self._index = index
+        if index is False:
+            return self.anyOf
+        return index.get(s.type, [])
+
+    def discriminator(self):
+        ''' For a tagged union, i.e. object branches which all require
+            the same property with a single value, returns that property
+            and a map from its values to the branches; False otherwise. '''
+        if self._discriminator is None:
+            # As in branchesFor, publish the result once complete.
+            discriminator = False
+            objects = [i for i in self.anyOf if i.type == "object"]
+            if len(objects) > 1 and not any(i.type == "top" for i in self.anyOf):
+                fixed = [fixed_properties(i) for i in objects]
+                for k in sorted(fixed[0]):
+                    variants = {}
+                    for i, f in zip(objects, fixed):
+                        v = f.get(k)
+                        if v is None:
+                            break
+                        variants.setdefault(v, []).append(i)
+                    else:
+                        discriminator = (k, variants)
+                        break
+            self._discriminator = discriminator
+        return self._discriminator
+
+    def subtypeCandidatesFor(self, s):
+        ''' Branches which s might be a subtype of. For a tagged union,
+            an object which fixes the tag can only be a subtype of the
+            variants with the same tag, so look those up directly. '''
+        if s.type == "object" and not s.hasEnum():
+            discriminator = self.discriminator()
+            if discriminator:
+                k, variants = discriminator
+                v = fixed_property(s, k)
+                if v is not None:
+                    stats.count("discriminator_lookups")
+                    return variants.get(v, [])
+        return self.branchesFor(s)
+
     def _meet(self, s):
 
         return super().meet_handle_rhs(s, JSONanyOf._meetAnyOf)
@@ -1496,10 +2063,12 @@ class JSONanyOf(JSONschema):
     @staticmethod
     def _meetAnyOf(s1, s2):
         anyofs = []
-        for i in s1.anyOf:
+        branches = s1.anyOf if s2.type == "anyOf" else s1.branchesFor(s2)
+        for i in branches:
             tmp = i.meet(s2)
             if not is_bot(tmp):
                 anyofs.append(tmp)
+        anyofs = prune_anyOf(anyofs)
 
         if len(anyofs) > 1:
             return JSONanyOf({"anyOf": anyofs})
@@ -1509,23 +2078,9 @@ class JSONanyOf(JSONschema):
             return JSONbot()
 
     def _join(self, s):
-        ret = []
-        if s.type == "anyOf":
-            return JSONanyOfFactory({"anyOf": self.anyOf + s.anyOf})
-        else:
-            for i in self.anyOf:
-                if i.type == s.type:
-                    t = i.join(s)
-                    if t.type != "anyOf":
-                        # successful join, add new result and terminate
-                        self.anyOf.remove(i)
-                        self.anyOf.append(t)
-                        break
-            else:
-                # loop exited normally without breaking
-                # so add the single schema manually
-                self.anyOf.append(s)
-            return self
+        # Don't modify self; it might be shared,
+        # e.g. a memoized negation result.
+        return JSONanyOfFactory({"anyOf": self.anyOf + [s]})
 
     def _isSubtype(self, s):
 
@@ -1539,11 +2094,51 @@ class JSONanyOf(JSONschema):
         return _isAnyofSubtype(self, s)
 
 
+# Rough relative cost of meeting schemas of each type.
+meet_cost = {"null": 0, "boolean": 1, "integer": 2, "number": 3,
+             "string": 4, "array": 5, "object": 6, "anyOf": 7}
+
+# Below this many operands, folding left to right was measured to be
+# at least as fast as a pairwise reduction.
+allOf_balanced_threshold = 32
+
+
 def JSONallOfFactory(s):
-    ret = JSONtop()
+    ''' Meet all schemas in s["allOf"].
+        If their type masks do not intersect, the meet is bot without
+        any actual meet. Otherwise, cheap schemas are met first, grouped
+        by type, and we stop as soon as an intermediate meet is bot.
+        Long allOfs are first reduced pairwise, to keep intermediate results small. '''
+    allofs = []
+    mask = definitions.JtypesAllBits
     for i in s.get("allOf"):
-        ret = ret.meet(i)
+        if is_top(i):
+            continue
+        if is_bot(i):
+            return JSONbot()
+        mask &= i.typeMask()
+        allofs.append(i)
+    if not mask:
+        stats.count("allOf_disjoint")
+        return JSONbot()
+
+    allofs.sort(key=lambda i: meet_cost[i.type])
+    while len(allofs) > allOf_balanced_threshold:
+        pairs = []
+        for j in range(0, len(allofs) - 1, 2):
+            ret = allofs[j].meet(allofs[j + 1])
+            if is_bot(ret):
+                return JSONbot()
+            pairs.append(ret)
+        if len(allofs) % 2:
+            pairs.append(allofs[-1])
+        allofs = pairs
 
+    ret = JSONtop()
+    for i in allofs:
+        ret = ret.meet(i)
+        if is_bot(ret):
+            return JSONbot()
     return ret
 
 
@@ -1575,7 +2170,20 @@ boolToConstructor = {
 
 
 def get_default_types_except(*args):
-    ret = []
-    for t in set(typeToConstructor.keys()).difference(args):
-        ret.append(typeToConstructor[t]({}))
-    return ret
+    return [default_types[t] for t in typeToConstructor.keys() if t not in args]
+
+
+@session_cached("negation_cache", "NEGATION_CACHE_SIZE")
+def _negate_canonical(t, key):
+    return typeToConstructor[t].neg(json.loads(key))
+
+
+def negate(s):
+    ''' Negation of the canonical single type schema s.
+        Results are memoized, so they must never be modified in place. '''
+    return _negate_canonical(s["type"], json.dumps(s, sort_keys=True))
+
+
+# Unconstrained schema of every type. These are shared
+# by every negation, so they must never be modified in place.
+default_types = {t: c({}) for t, c in typeToConstructor.items()}
@@ -0,0 +1,96 @@
+'''
+Created on October 19, 2026
+'''
+
+import contextlib
+import functools
+import threading
+import time
+
+from jsonsubschema.exceptions import (
+    Cancelled,
+    LimitExceeded
+)
+
+_scope = threading.local()
+
+
+class Limits(object):
+    ''' Wall-clock, node construction and recursion depth limits
+        of one operation, and how much of them is used so far. '''
+
+    __slots__ = ("timeout", "deadline", "max_nodes", "nodes", "max_depth", "depth")
+
+    def __init__(self, timeout=None, max_nodes=None, max_depth=None):
+        self.timeout = timeout
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.max_depth = max_depth
+        self.depth = 0
+
+    def check(self):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise LimitExceeded("timeout", self.timeout)
+        if self.max_depth is not None and self.depth > self.max_depth:
+            raise LimitExceeded("max_depth", self.max_depth)
+
+
+@contextlib.contextmanager
+def cancellable(event):
+    ''' Operations on the running thread stop at their next checkpoint
+        with Cancelled once the threading.Event event is set. '''
+    outer = getattr(_scope, "cancelled", None)
+    _scope.cancelled = event
+    try:
+        yield
+    finally:
+        _scope.cancelled = outer
+
+
+@contextlib.contextmanager
+def limited(limits):
+    ''' Operations on the running thread stop at their next checkpoint
+        with LimitExceeded once they exceed limits. '''
+    outer = getattr(_scope, "limits", None)
+    _scope.limits = limits
+    try:
+        yield
+    finally:
+        _scope.limits = outer
+
+
+def checkpoint():
+    ''' Called at each step of the long running operations. '''
+    cancelled = getattr(_scope, "cancelled", None)
+    if cancelled is not None and cancelled.is_set():
+        raise Cancelled()
+    limits = getattr(_scope, "limits", None)
+    if limits is not None:
+        limits.check()
+
+
+def checkpointed(f):
+    ''' Decorator for the recursive operations, making each call
+        a checkpoint and keeping track of the recursion depth. '''
+    @functools.wraps(f)
+    def wrapper(*args):
+        checkpoint()
+        limits = getattr(_scope, "limits", None)
+        if limits is None or limits.max_depth is None:
+            return f(*args)
+        limits.depth += 1
+        try:
+            return f(*args)
+        finally:
+            limits.depth -= 1
+    return wrapper
+
+
+def count_node():
+    ''' Called for each checker node built. '''
+    limits = getattr(_scope, "limits", None)
+    if limits is not None and limits.max_nodes is not None:
+        limits.nodes += 1
+        if limits.nodes > limits.max_nodes:
+            raise LimitExceeded("max_nodes", limits.max_nodes)
@@ -21,6 +21,14 @@ JtypesToKeywords = {
     "object": ["properties", "additionalProperties", "required", "minProperties", "maxProperties", "dependencies", "patternProperties"]
 }
 
+# One bit per type; a schema's type mask has the bits of the types
+# it may validate, so a meet is bot if the masks do not intersect.
+# (integer is a subset of number, so number has both bits.)
+JtypesToBits = dict((t, 1 << i) for i, t in enumerate(sorted(Jtypes)))
+JtypesToBits["number"] |= JtypesToBits["integer"]
+
+JtypesAllBits = reduce(operator.or_, JtypesToBits.values())
+
 Jconnectors = set(["anyOf", "allOf", "oneOf", "not"])
 
 Jcommonkw = Jconnectors.union(["enum", "type"])
@@ -0,0 +1,128 @@
+'''
+Created on October 19, 2026
+'''
+
+import collections
+import contextlib
+import functools
+import threading
+
+import jsonsubschema.config as config
+import jsonsubschema.stats as stats
+
+
+class Memo(object):
+    ''' Memo table keyed by structural digests of checker nodes.
+
+        Keying by structure rather than identity lets equal subschemas
+        built separately (e.g. the same item schema in several tuple slots,
+        or in every oneOf branch) share results. Beyond maxsize, the least
+        recently used entries are evicted. Hits and misses are counted
+        in jsonsubschema.stats under the name of the memo. '''
+
+    def __init__(self, name, maxsize=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.table = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        ''' Returns a 1-tuple holding the memoized value, or None. '''
+        with self.lock:
+            entry = self.table.get(key)
+            if entry is None:
+                stats.count(self.name + "_misses")
+                return None
+            stats.count(self.name + "_hits")
+            if self.maxsize:
+                self.table.move_to_end(key)
+            return entry
+
+    def put(self, key, value):
+        with self.lock:
+            self.table[key] = (value,)
+            if self.maxsize and len(self.table) > self.maxsize:
+                self.table.popitem(last=False)
+
+    def __len__(self):
+        return len(self.table)
+
+
+_scope = threading.local()
+
+
+def shared_memo(name, size):
+    ''' The memo called name of the current session,
+        or None if size is 0. '''
+    if not size:
+        return None
+    session = config.current()
+    memo = session.memos.get(name)
+    if memo is None or memo.maxsize != size:
+        with session.lock:
+            memo = session.memos.get(name)
+            if memo is None or memo.maxsize != size:
+                memo = session.memos[name] = Memo(name, size)
+    return memo
+
+
+def session_cached(name, size_setting):
+    ''' Like functools.lru_cache, but the cache is the memo called
+        name of the current session, sized by its size_setting. '''
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args):
+            memo = shared_memo(name, getattr(config.current(), size_setting))
+            if memo is None:
+                return f(*args)
+            entry = memo.get(args)
+            if entry is not None:
+                return entry[0]
+            ret = f(*args)
+            memo.put(args, ret)
+            return ret
+        return wrapper
+    return decorator
+
+
+def meet_cache():
+    return shared_memo("meet_cache", config.current().MEET_JOIN_CACHE_SIZE)
+
+
+def join_cache():
+    return shared_memo("join_cache", config.current().MEET_JOIN_CACHE_SIZE)
+
+
+def shared_subtype_memo():
+    ''' The subtype memo shared across checks, if enabled by
+        config.set_subtype_memo_size. '''
+    return shared_memo("subtype_memo", config.current().SUBTYPE_MEMO_SIZE)
+
+
+def current_subtype_memo():
+    return getattr(_scope, "memo", None)
+
+
+def new_subtype_memo():
+    ''' The memo shared across checks if enabled, or a fresh one. '''
+    memo = shared_subtype_memo()
+    if memo is None:
+        memo = Memo("subtype_memo")
+    return memo
+
+
+@contextlib.contextmanager
+def subtype_memo_scope(memo=None):
+    ''' Memoize subtype verdicts for the duration of one check,
+        in the given memo if any, e.g. one shared by a batch of checks.
+        Nested scopes reuse the memo of the outermost one. '''
+    if current_subtype_memo() is not None:
+        yield current_subtype_memo()
+        return
+    if memo is None:
+        memo = new_subtype_memo()
+    _scope.memo = memo
+    try:
+        yield memo
+    finally:
+        _scope.memo = None
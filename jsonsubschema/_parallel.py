@@ -0,0 +1,67 @@
+'''
+Created on October 19, 2026
+'''
+
+import concurrent.futures
+import math
+
+import jsonsubschema.config as config
+import jsonsubschema.stats as stats
+from jsonsubschema._memo import (
+    new_subtype_memo,
+    subtype_memo_scope
+)
+
+# Checker nodes of the batch, by digest, and the subtype memo
+# shared by all chunks of the batch, in each worker process.
+_nodes = {}
+_worker = {}
+
+
+def _init_worker(nodes, settings):
+    ''' Runs once in each worker: receive the nodes of the batch and
+        the settings of the session which started it. '''
+    _nodes.clear()
+    _nodes.update(nodes)
+    config.current().configure(settings)
+    _worker["memo"] = new_subtype_memo()
+
+
+def _check_chunk(chunk):
+    ''' Subtype checks of a chunk of (lhs digest, rhs digest) pairs.
+        Returns the verdicts in order, and the counters of the chunk
+        to be merged into the session which started the batch. '''
+    config.current().reset_stats()
+    with subtype_memo_scope(_worker["memo"]):
+        ret = [_nodes[d1].isSubtype(_nodes[d2]) for d1, d2 in chunk]
+    return ret, config.current().get_stats()
+
+
+def check_pairs(pairs, workers, chunksize=None):
+    ''' Subtype checks of the (lhs, rhs) pairs of checker nodes,
+        in a pool of worker processes. Each distinct node is sent
+        to each worker once, when the pool starts; tasks only refer
+        to nodes by digest. Verdicts are returned in order. '''
+    nodes = {}
+    keys = []
+    for s1, s2 in pairs:
+        nodes.setdefault(s1.digest(), s1)
+        nodes.setdefault(s2.digest(), s2)
+        keys.append((s1.digest(), s2.digest()))
+    if not keys:
+        return []
+    if not chunksize:
+        # A few chunks per worker balance uneven check costs.
+        chunksize = max(1, math.ceil(len(keys) / (workers * 4)))
+    chunks = [keys[i:i + chunksize] for i in range(0, len(keys), chunksize)]
+
+    ret = []
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(nodes, config.current().settings())) as executor:
+        for verdicts, counters in executor.map(_check_chunk, chunks):
+            ret.extend(verdicts)
+            for event, n in counters.items():
+                stats.count(event, n)
+    return ret
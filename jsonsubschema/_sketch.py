@@ -0,0 +1,74 @@
+'''
+Created on October 19, 2026
+'''
+
+import jsonsubschema._constants as definitions
+import jsonsubschema.stats as stats
+
+
+INTEGER_BIT = definitions.JtypesToBits["integer"]
+NUMBER_BITS = definitions.JtypesToBits["number"]
+
+
+def subtype_mask(mask):
+    ''' Types a subtype of a schema with type mask mask may have.
+        The subtype check allows a number schema to be a subtype
+        of an integer schema. '''
+    if mask & INTEGER_BIT:
+        return mask | NUMBER_BITS
+    return mask
+
+
+class Sketch(object):
+    ''' Compact summary of a checker node, enough to settle
+        some subtype checks and meets without looking deeper.
+
+        Every test here is a necessary condition which the full
+        subtype check (resp. meet) of the node already enforces,
+        so a sketch never changes a verdict, it only gets there sooner. '''
+
+    __slots__ = ("type", "mask", "enum", "pattern", "interval",
+                 "required")
+
+    def __init__(self, s):
+        self.type = s.type
+        self.mask = s.typeMask()
+        self.enum = s.hasEnum()
+        self.pattern = bool(getattr(s, "pattern", None))
+        self.interval = getattr(s, "interval", None)
+        if s.type == "object":
+            self.required = frozenset(s.required)
+        else:
+            self.required = None
+
+    def subtype_mask(self):
+        return subtype_mask(self.mask)
+
+    def mayBeSubtype(self, s):
+        ''' False if the node of this sketch can not be a subtype
+            of the node of sketch s; True if it might be. '''
+        if self.mask & ~s.subtype_mask():
+            return False
+        if self.enum or self.interval is None or s.interval is None:
+            return True
+        # Interval nesting is checked by the subtype check of
+        # arrays, objects and numerics, and of strings without patterns.
+        if self.type == s.type or (self.type in definitions.Jnumeric
+                                   and s.type in definitions.Jnumeric):
+            if self.type != "string" or not (self.pattern or s.pattern):
+                if self.interval not in s.interval:
+                    return False
+        if self.type == "object" and s.type == "object":
+            if not self.required.issuperset(s.required):
+                return False
+        return True
+
+    def mayMeet(self, s):
+        ''' False if the meet of the nodes of both sketches is bot. '''
+        return bool(self.mask & s.mask)
+
+
+def settled(verdict):
+    ''' Count a pair settled by sketches alone and pass the verdict on. '''
+    stats.count("sketch_settled")
+    return verdict
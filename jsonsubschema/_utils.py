@@ -14,9 +14,11 @@ import json
 
 import jsonschema
 import intervals as I
+from greenery.fsm import anything_else
 from greenery.lego import parse
 
 import jsonsubschema.config as config
+from jsonsubschema._memo import session_cached
 import jsonsubschema._constants as definitions
 
 
@@ -71,7 +73,7 @@ def is_dict(i):
 
 
 def validate_schema(s):
-    return config.VALIDATOR.check_schema(s)
+    return config.current().VALIDATOR.check_schema(s)
 
 
 def get_valid_enum_vals(enum, s):
@@ -103,7 +105,7 @@ def get_typed_enum_vals(enum, t):
 
 
 def print_db(*args):
-    if config.PRINT_DB:
+    if config.current().PRINT_DB:
         if args:
             print("".join(str(arg) + " " for arg in args))
         else:
@@ -160,9 +162,15 @@ def regex_unanchor(p):
     return p
 
 
+@session_cached("regex_fsm", "REGEX_CACHE_SIZE")
+def regex_fsm(regex):
+    # Building the automaton dominates matching a single string.
+    return parse(regex).to_fsm()
+
+
 def regex_matches_string(regex=None, s=None):
     if regex:
-        return parse(regex).matches(s)
+        return regex_fsm(regex).accepts(s)
     else:
         return True
 
@@ -202,6 +210,69 @@ def regex_isSubset(s1, s2):
         return False
 
 
+@session_cached("regex_inclusions", "REGEX_CACHE_SIZE")
+def regex_inclusions(subs, sups, max_states=10000):
+    ''' All pairs (s1, s2) of patterns from the tuples subs and sups
+        such that regex_isSubset(s1, s2).
+
+        Rather than one inclusion check per pair, run the automata of
+        all patterns in parallel, once: s1 is a subset of s2 iff no
+        reachable tuple of states has s1 accepting and s2 not.
+        Falls back to pairwise checks if the product gets too big. '''
+    patterns = list(subs) + [i for i in sups if i not in subs]
+    try:
+        if not all(patterns):
+            raise ValueError("empty pattern")
+        fsms = [regex_fsm(i) for i in patterns]
+    except Exception:
+        return frozenset((s1, s2) for s1 in subs for s2 in sups
+                         if regex_isSubset(s1, s2))
+
+    alphabet = set().union(*(m.alphabet for m in fsms))
+    symbols = [[(a if a in m.alphabet or anything_else not in m.alphabet
+                 else anything_else) for m in fsms] for a in alphabet]
+
+    def accepting(state):
+        return frozenset(i for i, (q, m) in enumerate(zip(state, fsms))
+                         if q is not None and q in m.finals)
+
+    # for each pattern, the patterns rejecting a string it accepts.
+    rejecting = [set() for _ in patterns]
+    everything = frozenset(range(len(patterns)))
+    initial = tuple(m.initial for m in fsms)
+    seen = {initial}
+    todo = [initial]
+    while todo:
+        if len(seen) > max_states:
+            return frozenset((s1, s2) for s1 in subs for s2 in sups
+                             if regex_isSubset(s1, s2))
+        state = todo.pop()
+        finals = accepting(state)
+        if finals:
+            rest = everything - finals
+            for i in finals:
+                rejecting[i].update(rest)
+        for actual in symbols:
+            next = tuple(m.map.get(q, {}).get(a) if q is not None else None
+                         for q, m, a in zip(state, fsms, actual))
+            if any(q is not None for q in next) and next not in seen:
+                seen.add(next)
+                todo.append(next)
+
+    index = dict((p, i) for i, p in enumerate(patterns))
+    return frozenset((s1, s2) for s1 in subs for s2 in sups
+                     if index[s2] not in rejecting[index[s1]])
+
+
+@session_cached("regex_infinite", "REGEX_CACHE_SIZE")
+def regex_is_infinite(regex):
+    try:
+        parse(regex).cardinality()
+        return False
+    except OverflowError:
+        return True
+
+
 # def regex_isProperSubset(s1, s2):
 #     ''' regex proper subset is quite expensive to compute
 #         so we try to break it into two separate checks,
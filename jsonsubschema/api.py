@@ -3,14 +3,42 @@ Created on June 24, 2019
 @author: Andrew Habib
 '''
 
+import asyncio
+import concurrent.futures
+import copy
+import itertools
 import json
 import jsonref
+import threading
+
+import jsonsubschema.config as config
+import jsonsubschema.stats as stats
 
 from jsonsubschema._canonicalization import (
     canonicalize_schema,
-    simplify_schema_and_embed_checkers
+    is_marked_canonical,
+    mark_canonical,
+    simplify_schema_and_embed_checkers,
+    unmark_canonical
+)
+from jsonsubschema._checkers import is_bot
+from jsonsubschema._checkpoint import (
+    Limits,
+    cancellable,
+    limited
 )
+from jsonsubschema._memo import (
+    Memo,
+    new_subtype_memo,
+    shared_memo,
+    subtype_memo_scope
+)
+from jsonsubschema._parallel import check_pairs
+from jsonsubschema._sketch import subtype_mask
+from jsonsubschema.exceptions import LimitExceeded
+from jsonsubschema.session import Session
 from jsonsubschema._utils import (
+    is_num,
     validate_schema,
     print_db
 )
@@ -29,55 +57,591 @@ class JSONSubSchemaFactory(json.JSONDecoder):
             canonicalize_schema(d))
 
 
-def prepare_operands(s1, s2):
+class CompiledSchema(object):
+    ''' Immutable handle on a schema which is already resolved,
+        canonicalized and embedded with checkers; see compile().
+        Pass it to the entry points in place of the schema to skip
+        preparing it again. Handles can be pickled, e.g. to be
+        sent to worker processes. '''
+
+    __slots__ = ("_schema", "_digest")
+
+    def __init__(self, checker):
+        object.__setattr__(self, "_schema", checker)
+        object.__setattr__(self, "_digest", checker.digest())
+        # Compute the sketch now, so it travels with the handle.
+        checker.sketch()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledSchema is immutable")
+
+    def __reduce__(self):
+        return (CompiledSchema, (self._schema,))
+
+    @property
+    def schema(self):
+        return self._schema
+
+    @property
+    def digest(self):
+        return self._digest
+
+    @property
+    def sketch(self):
+        return self._schema.sketch()
+
+    def __eq__(self, other):
+        return isinstance(other, CompiledSchema) and self._digest == other._digest
+
+    def __hash__(self):
+        return hash(self._digest)
+
+    def __repr__(self):
+        return "CompiledSchema(" + self._digest[:12] + ")"
+
+
+def prepare_operand(s, name="schema"):
+    # Compiled schemas are ready to use as is;
+    # checker nodes are never modified by the operations.
+    if isinstance(s, CompiledSchema):
+        return s.schema
+
+    # For the same reason, canonicalized operands can be reused
+    # across calls, if enabled by config.set_canonical_cache_size.
+    cache = shared_memo("canonical_cache", config.current().CANONICAL_CACHE_SIZE)
+    if cache is not None:
+        try:
+            key = json.dumps(s, sort_keys=True)
+        except (TypeError, ValueError):
+            return _prepare_operand(s, name)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+        ret = _prepare_operand(s, name)
+        cache.put(key, ret)
+        return ret
+
+    return _prepare_operand(s, name)
+
+
+def _prepare_operand(s, name):
+    # Output of canonicalize() carries a content hash marker.
+    # If it still matches the content, the schema is already
+    # resolved and canonical, so go straight to embedding checkers.
+    # Embedding modifies the schema in place, so work on a copy.
+    if is_marked_canonical(s):
+        print_db(name + "_canonical", s)
+        print_db()
+        return simplify_schema_and_embed_checkers(
+            copy.deepcopy(unmark_canonical(s)))
+
     # First, we reload schemas using jsonref to resolve $ref
     # before starting canonicalization.
     # At the moment, we will get undefined behaviour for recursive/circual refs.
 
-    # s1 = jsonref.loads(json.dumps(s1))
-    # s2 = jsonref.loads(json.dumps(s2))
+    # s = jsonref.loads(json.dumps(s))
     # This is not very efficient, should be done lazily maybe?
-    s1 = jsonref.JsonRef.replace_refs(s1)
-    s2 = jsonref.JsonRef.replace_refs(s2)
+    s = jsonref.JsonRef.replace_refs(s)
 
-    # Canonicalize and embed checkers for both lhs
-    # and rhs schemas  before starting the subtype checking.
+    # Canonicalize and embed checkers before starting the subtype checking.
     # This also validates input schemas and canonicalized schemas.
 
-    print_db("LHS", s1)
+    print_db(name, s)
     print_db()
-    s1 = simplify_schema_and_embed_checkers(
-        canonicalize_schema(s1))
-    print_db("LHS_canonical", s1)
+    s = simplify_schema_and_embed_checkers(
+        canonicalize_schema(s))
+    print_db(name + "_canonical", s)
     print_db()
+    return s
+
+
+def prepare_operands(s1, s2):
+    return prepare_operand(s1, "LHS"), prepare_operand(s2, "RHS")
+
+
+def operand_preparer():
+    ''' Returns a version of prepare_operand which canonicalizes
+        and embeds checkers in each distinct schema only once.
+        Checker nodes are never modified by subtype checks,
+        so one node can serve as operand of many checks. '''
+    prepared = {}
+
+    def prepare(s, name="schema"):
+        if isinstance(s, CompiledSchema):
+            return s.schema
+        try:
+            key = json.dumps(s, sort_keys=True)
+        except (TypeError, ValueError):
+            key = id(s)
+        if key in prepared:
+            stats.count("operands_reused")
+        else:
+            # Keep s alive, in case it is keyed by id.
+            prepared[key] = (s, prepare_operand(s, name))
+        return prepared[key][1]
+
+    return prepare
+
+
+def canonicalize(s):
+    ''' Entry point for schema canonicalization.
+        The result is marked with a hash of its content, so passing it
+        to the other entry points later skips canonicalization. '''
+    s = jsonref.JsonRef.replace_refs(s)
+    return mark_canonical(canonicalize_schema(s))
+
+
+def compile_schema(s):
+    ''' Entry point for preparing a schema once, to be used
+        in many operations. Returns a CompiledSchema handle. '''
+    return CompiledSchema(prepare_operand(s))
+
+
+class Unknown(object):
+    ''' Result of an operation stopped by one of its limits, before
+        reaching a verdict. reason is the limit which was exceeded:
+        "timeout", "max_nodes" or "max_depth".
+        Unknown is falsy, so only proven subtypes pass `if isSubschema(...)`;
+        tell it apart from False with isinstance. '''
+
+    __slots__ = ("reason",)
+
+    def __init__(self, reason):
+        self.reason = reason
+
+    def __bool__(self):
+        return False
+
+    def __eq__(self, other):
+        return isinstance(other, Unknown) and self.reason == other.reason
+
+    def __hash__(self):
+        return hash((Unknown, self.reason))
+
+    def __repr__(self):
+        return "Unknown({!r})".format(self.reason)
+
+
+def run_limited(f, *args, timeout=None, max_nodes=None, max_depth=None):
+    ''' Run f(*args), preparing the operands included, within
+        the limits: timeout in seconds of wall-clock, max_nodes checker
+        nodes built, and max_depth nested meet, join and subtype steps.
+        Returns Unknown if any limit is exceeded. '''
+    if timeout is None and max_nodes is None and max_depth is None:
+        return f(*args)
+    try:
+        with limited(Limits(timeout, max_nodes, max_depth)):
+            return f(*args)
+    except LimitExceeded as e:
+        stats.count("limit_exceeded")
+        return Unknown(e.reason)
+
+
+def isSubschema(s1, s2, **limits):
+    ''' Entry point for schema subtype checking.
+        Takes the optional limits of run_limited. '''
+    return run_limited(_isSubschema, s1, s2, **limits)
+
+
+def _isSubschema(s1, s2):
+    s1, s2 = prepare_operands(s1, s2)
+    with subtype_memo_scope():
+        return s1.isSubtype(s2)
+
+
+def isSubschemaMatrix(lhs_list, rhs_list, workers=None):
+    ''' Subtype checks of every schema in lhs_list against every
+        schema in rhs_list, as a list of rows, one per lhs schema.
+        Each distinct schema is canonicalized once, and all checks
+        share one subtype memo.
+        If workers is given, the checks run in that many processes. '''
+    prepare = operand_preparer()
+    lhs_list = [prepare(s, "LHS") for s in lhs_list]
+    rhs_list = [prepare(s, "RHS") for s in rhs_list]
+    if workers:
+        verdicts = check_pairs([(s1, s2) for s1 in lhs_list for s2 in rhs_list], workers)
+        n = len(rhs_list)
+        return [verdicts[i * n:(i + 1) * n] for i in range(len(lhs_list))]
+    with subtype_memo_scope():
+        return [[s1.isSubtype(s2) for s2 in rhs_list] for s1 in lhs_list]
+
+
+def isSubschemaPairs(pairs, workers=None):
+    ''' Iterator over the subtype checks of the (lhs, rhs) pairs.
+        Each distinct schema is canonicalized once, when first seen,
+        and all checks share one subtype memo.
+        If workers is given, the checks run in that many processes;
+        then all pairs are read and prepared before the first result. '''
+    prepare = operand_preparer()
+    if workers:
+        pairs = [(prepare(s1, "LHS"), prepare(s2, "RHS")) for s1, s2 in pairs]
+        for ret in check_pairs(pairs, workers):
+            yield ret
+        return
+    memo = new_subtype_memo()
+    for s1, s2 in pairs:
+        s1, s2 = prepare(s1, "LHS"), prepare(s2, "RHS")
+        with subtype_memo_scope(memo):
+            ret = s1.isSubtype(s2)
+        yield ret
 
-    print_db("RHS", s2)
-    print_db()
-    s2 = simplify_schema_and_embed_checkers(
-        canonicalize_schema(s2))
-    print_db("RHS_canonical", s2)
-    print_db()
-    return s1, s2
 
+def meet(s1, s2, **limits):
+    ''' Entry point for schema meet operation.
+        Takes the optional limits of run_limited. '''
+    return run_limited(_meet, s1, s2, **limits)
 
-def isSubschema(s1, s2):
-    ''' Entry point for schema subtype checking. '''
+
+def _meet(s1, s2):
     s1, s2 = prepare_operands(s1, s2)
-    return s1.isSubtype(s2)
+    # Results may be cached, or be (parts of) compiled operands,
+    # so hand out a copy which callers are free to modify.
+    return copy.deepcopy(s1.meet(s2))
+
+
+def join(s1, s2, **limits):
+    ''' Entry point for schema meet operation.
+        Takes the optional limits of run_limited. '''
+    return run_limited(_join, s1, s2, **limits)
+
+
+def _join(s1, s2):
+    s1, s2 = prepare_operands(s1, s2)
+    # See _meet.
+    return copy.deepcopy(s1.join(s2))
+
 
+def isEquivalent(s1, s2, **limits):
+    ''' Entry point for schema equivalence check operation.
+        Takes the optional limits of run_limited, which bound
+        both subtype checks together. '''
+    return run_limited(_isEquivalent, s1, s2, **limits)
 
-def meet(s1, s2):
-    ''' Entry point for schema meet operation. '''
+
+def _isEquivalent(s1, s2):
+    # As _compare, but stop as soon as one direction fails.
     s1, s2 = prepare_operands(s1, s2)
-    return s1.meet(s2)
+    if s1.isIdentical(s2):
+        stats.count("identical_pairs")
+        return True
+    with subtype_memo_scope():
+        return s1.isSubtype(s2) and s2.isSubtype(s1)
+
+
+# Results of compare
+EQUAL = "equal"
+SUB = "sub"
+SUPER = "super"
+INCOMPARABLE = "incomparable"
+
 
+def compare(s1, s2, **limits):
+    ''' Entry point for checking both subtype directions at once.
+        Returns EQUAL, SUB (s1 is a subtype of s2), SUPER (s2 is
+        a subtype of s1) or INCOMPARABLE.
+        Takes the optional limits of run_limited, which bound
+        both subtype checks together. '''
+    return run_limited(_compare, s1, s2, **limits)
 
-def join(s1, s2):
-    ''' Entry point for schema meet operation. '''
+
+def _compare(s1, s2):
+    # Each operand is prepared once, and both directions
+    # share the same checker nodes and subtype memo.
     s1, s2 = prepare_operands(s1, s2)
-    return s1.join(s2)
+    if s1.isIdentical(s2):
+        stats.count("identical_pairs")
+        return EQUAL
+    with subtype_memo_scope():
+        sub = s1.isSubtype(s2)
+        sup = s2.isSubtype(s1)
+    if sub:
+        return EQUAL if sup else SUB
+    return SUPER if sup else INCOMPARABLE
+
+
+async def run_in_executor(f, *args, executor=None, **kwargs):
+    ''' Run f(*args, **kwargs) on the executor (by default, that of the
+        running loop) in the current session. If the awaiting task is
+        cancelled, f stops at its next checkpoint rather than running
+        to completion. The executor must run its tasks in threads of
+        this process, e.g. a ThreadPoolExecutor: the session and the
+        cancellation event are shared with f, not sent to it. '''
+    if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+        raise TypeError("run_in_executor needs a thread based executor")
+    loop = asyncio.get_running_loop()
+    session = config.current()
+    cancelled = threading.Event()
+
+    def run():
+        with session.activate(), cancellable(cancelled):
+            return f(*args, **kwargs)
+
+    try:
+        return await loop.run_in_executor(executor, run)
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+
+
+async def aisSubschema(s1, s2, executor=None, **limits):
+    ''' Entry point for schema subtype checking, without blocking the event loop. '''
+    return await run_in_executor(isSubschema, s1, s2, executor=executor, **limits)
+
+
+async def ameet(s1, s2, executor=None, **limits):
+    ''' Entry point for schema meet operation, without blocking the event loop. '''
+    return await run_in_executor(meet, s1, s2, executor=executor, **limits)
+
+
+async def ajoin(s1, s2, executor=None, **limits):
+    ''' Entry point for schema join operation, without blocking the event loop. '''
+    return await run_in_executor(join, s1, s2, executor=executor, **limits)
+
+
+async def aisEquivalent(s1, s2, executor=None, **limits):
+    ''' Entry point for schema equivalence check, without blocking the event loop. '''
+    return await run_in_executor(isEquivalent, s1, s2, executor=executor, **limits)
+
+
+async def acompare(s1, s2, executor=None, **limits):
+    ''' Entry point for checking both subtype directions, without blocking the event loop. '''
+    return await run_in_executor(compare, s1, s2, executor=executor, **limits)
+
+
+class SchemaHistory(object):
+    ''' Successive versions of an evolving schema, e.g. in a schema
+        registry, for checking each new version against previous ones.
+
+        Versions are compiled once, and all checks share one subtype memo
+        keyed by structural digests, which hash each subtree from those
+        of its children. Subtrees a new version shares with an old one
+        have equal digests and are settled without descending into them,
+        and pairs of subtrees already checked against earlier versions are
+        memo hits, so only the changed paths and their ancestors are
+        actually rechecked. '''
+
+    def __init__(self, versions=(), memo_size=65536):
+        self.versions = []
+        self.memo = Memo("subtype_memo", memo_size)
+        for s in versions:
+            self.add(s)
+
+    def add(self, s):
+        ''' Append s as the latest version. Returns its CompiledSchema. '''
+        if not isinstance(s, CompiledSchema):
+            s = compile_schema(s)
+        self.versions.append(s)
+        return s
+
+    def check(self, s, k=1, add=True):
+        ''' compare() of each of the k latest versions, latest first,
+            with s. "sub" or "equal" means s is backward compatible
+            with that version: it accepts every instance the version did.
+            Unless add is False, s then becomes the latest version. '''
+        new = s if isinstance(s, CompiledSchema) else compile_schema(s)
+        old = self.versions[-k:] if k > 0 else []
+        with subtype_memo_scope(self.memo):
+            ret = [compare(v, new) for v in reversed(old)]
+        if add:
+            self.versions.append(new)
+        return ret
+
+
+class SchemaIndex(object):
+    ''' Corpus of compiled schemas, by key, for finding the schemas
+        which are supertypes (or subtypes) of a query schema.
+
+        Queries first narrow the corpus down using the sketches of the
+        schemas: their type masks, which the schemas are grouped by,
+        and for object schemas their required keys, which are indexed,
+        and the property names of the closed ones, which accept no
+        other property. Only the candidates which pass the full sketch
+        test are then checked for real, and all checks share one
+        subtype memo.
+        Uninhabited schemas are kept apart: sketches say nothing about
+        them, as they are subtypes of every schema. '''
+
+    def __init__(self, schemas=(), memo_size=65536):
+        self.schemas = {}               # Key -> CompiledSchema
+        self._seq = {}                  # Key -> insertion number, to order results
+        self._counter = itertools.count()
+        self._byMask = {}               # Type mask -> keys of schemas with that mask
+        self._byRequired = {}           # Property name -> keys of object schemas requiring it
+        self._closed = {}               # Key -> property names of closed object schemas
+        self._uninhabited = set()       # Keys of uninhabited schemas
+        self.memo = Memo("subtype_memo", memo_size)
+        for key, s in dict(schemas).items():
+            self.insert(key, s)
+
+    def __len__(self):
+        return len(self.schemas)
+
+    def __contains__(self, key):
+        return key in self.schemas
+
+    def insert(self, key, s):
+        ''' Add s under key, replacing any schema with the same key.
+            Returns its CompiledSchema. '''
+        if not isinstance(s, CompiledSchema):
+            s = compile_schema(s)
+        if key in self.schemas:
+            self.delete(key)
+        self.schemas[key] = s
+        self._seq[key] = next(self._counter)
+        if is_bot(s.schema):
+            self._uninhabited.add(key)
+            return s
+        sketch = s.sketch
+        self._byMask.setdefault(sketch.mask, set()).add(key)
+        if sketch.type == "object":
+            for k in sketch.required:
+                self._byRequired.setdefault(k, set()).add(key)
+            if not s.schema.patternProperties and is_bot(s.schema.additionalProperties):
+                self._closed[key] = frozenset(s.schema.properties)
+        return s
+
+    def delete(self, key):
+        ''' Remove the schema under key; KeyError if there is none. '''
+        sketch = self.schemas.pop(key).sketch
+        del self._seq[key]
+        if key in self._uninhabited:
+            self._uninhabited.discard(key)
+            return
+        self._byMask[sketch.mask].discard(key)
+        if not self._byMask[sketch.mask]:
+            del self._byMask[sketch.mask]
+        if sketch.type == "object":
+            for k in sketch.required:
+                self._byRequired[k].discard(key)
+                if not self._byRequired[k]:
+                    del self._byRequired[k]
+            self._closed.pop(key, None)
+
+    def supertypes_of(self, q):
+        ''' Keys of the schemas which accept every instance q accepts. '''
+        q = self._prepare(q)
+        if is_bot(q.schema):
+            return sorted(self.schemas, key=self._seq.__getitem__)
+        # Uninhabited schemas are supertypes of uninhabited schemas only.
+        sketch = q.sketch
+        candidates = set()
+        for mask, keys in self._byMask.items():
+            if not sketch.mask & ~subtype_mask(mask):
+                candidates |= keys
+        names = self._property_names(q)
+        if names is not None:
+            # Closed supertypes must name every property q may have.
+            candidates = set(key for key in candidates
+                             if key not in self._closed
+                             or names is not False and names <= self._closed[key])
+        return self._check(candidates,
+                           lambda s: sketch.mayBeSubtype(s.sketch),
+                           lambda s: q.schema.isSubtype(s.schema))
+
+    def subtypes_of(self, q):
+        ''' Keys of the schemas whose instances q all accepts. '''
+        q = self._prepare(q)
+        sketch = q.sketch
+        allowed = sketch.subtype_mask()
+        candidates = set()
+        for mask, keys in self._byMask.items():
+            if not mask & ~allowed:
+                candidates |= keys
+        if sketch.type == "object" and sketch.required:
+            # Object subtypes must require every key q requires.
+            required = set.intersection(*(self._byRequired.get(k, set())
+                                          for k in sketch.required))
+            candidates = set(key for key in candidates
+                             if key in required or self.schemas[key].sketch.type != "object")
+        return self._check(candidates,
+                           lambda s: s.sketch.mayBeSubtype(sketch),
+                           lambda s: s.schema.isSubtype(q.schema),
+                           self._uninhabited)
+
+    @staticmethod
+    def _property_names(q):
+        ''' Names of the properties which instances of q may have,
+            if they are a known, finite set; False if q is an object
+            schema which accepts arbitrary extra properties; None if
+            nothing can be told. Any property q allows may be added
+            to one of its instances, if q has no enum, patternProperties
+            or maxProperties; so closed schemas missing one of them
+            cannot be supertypes of q. '''
+        s = q.schema
+        if q.sketch.type != "object" or s.hasEnum() or s.patternProperties \
+                or is_num(s.maxProperties):
+            return None
+        if not is_bot(s.additionalProperties):
+            return False
+        return frozenset(k for k, v in s.properties.items() if not is_bot(v))
+
+    def _prepare(self, q):
+        return q if isinstance(q, CompiledSchema) else compile_schema(q)
+
+    def _check(self, candidates, prefilter, check, accepted=()):
+        ''' Keys of the candidates, in insertion order, which pass
+            both prefilter and check, and of the accepted ones. '''
+        ret = []
+        with subtype_memo_scope(self.memo):
+            for key in sorted(candidates | set(accepted), key=self._seq.__getitem__):
+                if key in accepted:
+                    ret.append(key)
+                    continue
+                s = self.schemas[key]
+                if prefilter(s):
+                    stats.count("index_checks")
+                    if check(s):
+                        ret.append(key)
+        return ret
+
+
+class Checker(Session):
+    ''' A session with its own configuration, caches and stats,
+        for running operations isolated from other sessions,
+        e.g. of other tenants of a service. Settings are given
+        to the constructor (see Session) or changed by the config.set_*
+        functions within an activate() block. The module level
+        entry points use the default session instead. '''
+
+    def isSubschema(self, s1, s2, **limits):
+        with self.activate():
+            return isSubschema(s1, s2, **limits)
+
+    def isSubschemaMatrix(self, lhs_list, rhs_list, workers=None):
+        with self.activate():
+            return isSubschemaMatrix(lhs_list, rhs_list, workers)
+
+    def isSubschemaPairs(self, pairs, workers=None):
+        # Don't keep the session active in between items.
+        checks = isSubschemaPairs(pairs, workers)
+        while True:
+            with self.activate():
+                try:
+                    ret = next(checks)
+                except StopIteration:
+                    return
+            yield ret
+
+    def meetSchemas(self, s1, s2, **limits):
+        with self.activate():
+            return meet(s1, s2, **limits)
+
+    def joinSchemas(self, s1, s2, **limits):
+        with self.activate():
+            return join(s1, s2, **limits)
+
+    def isEquivalent(self, s1, s2, **limits):
+        with self.activate():
+            return isEquivalent(s1, s2, **limits)
+
+    def compare(self, s1, s2, **limits):
+        with self.activate():
+            return compare(s1, s2, **limits)
 
+    def canonicalizeSchema(self, s):
+        with self.activate():
+            return canonicalize(s)
 
-def isEquivalent(s1, s2):
-    ''' Entry point for schema equivalence check operation. '''
-    return isSubschema(s1, s2) and isSubschema(s2, s1)
+    def compile(self, s):
+        with self.activate():
+            return compile_schema(s)
@@ -6,7 +6,12 @@ Created on June 24, 2019
 import sys
 
 from jsonsubschema._utils import load_json_file
-from jsonsubschema.api import isSubschema
+from jsonsubschema.api import (
+    EQUAL,
+    SUB,
+    SUPER,
+    compare
+)
 
 
 def main():
@@ -20,8 +25,10 @@ def main():
     s1 = load_json_file(s1_file, "LHS file:")
     s2 = load_json_file(s2_file, "RHS file:")
 
-    print("LHS <: RHS", isSubschema(s1, s2))
-    print("RHS <: LHS", isSubschema(s2, s1))
+    # Both directions at once, canonicalizing each schema once.
+    ret = compare(s1, s2)
+    print("LHS <: RHS", ret in (EQUAL, SUB))
+    print("RHS <: LHS", ret in (EQUAL, SUPER))
 
 
 if __name__ == "__main__":
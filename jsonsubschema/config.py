@@ -3,14 +3,14 @@ Created on June 24, 2019
 @author: Andrew Habib
 '''
 
-import sys
 import jsonschema
 
-this = sys.modules[__name__]
+from jsonsubschema.session import current
 
-this.VALIDATOR = jsonschema.Draft4Validator     # Which schema validator draft to use
-this.PRINT_DB = False                           # Print debugging info?
-this.WARN_UNINHABITED = False                   # Enable uninhabited types warning?
+# Settings live in sessions, see jsonsubschema.session.Session.
+# Read them with config.current().<SETTING>; the functions below
+# change the current session, which is the default session
+# unless called from within an active session.
 
 
 # API to set which schema validator draft to use
@@ -19,20 +19,56 @@ def set_json_validator_version(v=jsonschema.Draft4Validator):
         so VALIDATOR should not changed.
         We prodive the method for future support of other json schema versions. '''
 
-    this.VALIDATOR = v
+    current().VALIDATOR = v
 
 
 # API to set print debugging info?
 def set_debug(b=False):
     if b:
-        this.PRINT_DB = True
+        current().PRINT_DB = True
     else:
-        this.PRINT_DB = False
+        current().PRINT_DB = False
 
 
 # API to enable uninhabited types warning?
 def set_warn_uninhabited(b=False):
     if b:
-        this.WARN_UNINHABITED = True
+        current().WARN_UNINHABITED = True
     else:
-        this.WARN_UNINHABITED = False
+        current().WARN_UNINHABITED = False
+
+
+# API to share subtype verdicts across calls in an LRU memo of size n
+def set_subtype_memo_size(n=0):
+    ''' By default, subtype verdicts are memoized for the duration
+        of a single check only. '''
+
+    current().SUBTYPE_MEMO_SIZE = n
+
+
+# API to set the size of the meet and join result caches
+def set_meet_join_cache_size(n=1024):
+    current().MEET_JOIN_CACHE_SIZE = n
+
+
+# API to drop anyOf branches which are subtypes of a sibling branch
+def set_anyOf_prune_budget(n=0):
+    ''' n bounds the number of subtype checks spent on pruning each anyOf.
+        Duplicate branches are always dropped. '''
+
+    current().ANYOF_PRUNE_BUDGET = n
+
+
+# API to set the size of the regex automata and inclusion caches
+def set_regex_cache_size(n=1024):
+    current().REGEX_CACHE_SIZE = n
+
+
+# API to set the size of the cache of negated canonical schemas
+def set_negation_cache_size(n=1024):
+    current().NEGATION_CACHE_SIZE = n
+
+
+# API to reuse canonicalized operands across calls in an LRU cache of size n
+def set_canonical_cache_size(n=0):
+    current().CANONICAL_CACHE_SIZE = n
@@ -19,6 +19,26 @@ class UnexpectedCanonicalization(_Error):
         return '{}\n"type": {} \n"schema": {}'.format(self.msg, self.tau, self.schema)
 
 
+class Cancelled(_Error):
+    ''' Raised at a checkpoint of an operation which was cancelled,
+        e.g. by cancelling the task awaiting one of the async entry points. '''
+
+    def __str__(self):
+        return 'Operation cancelled'
+
+
+class LimitExceeded(_Error):
+    ''' Raised at a checkpoint of an operation which exceeded one of its
+        limits; the entry points turn it into an Unknown verdict. '''
+
+    def __init__(self, reason, limit):
+        self.reason = reason
+        self.limit = limit
+
+    def __str__(self):
+        return '{} limit of {} exceeded'.format(self.reason, self.limit)
+
+
 # class UnsupportedSchemaType(_Error):
 #     '''
 #     Probably this is not required since custom types are not
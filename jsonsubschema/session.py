@@ -0,0 +1,82 @@
+'''
+Created on October 19, 2026
+'''
+
+import collections
+import contextlib
+import threading
+
+import jsonschema
+
+
+class Session(object):
+    ''' Configuration, caches and stats of a series of operations.
+
+        Every setting, cache and counter used while checking is looked up
+        in the current session of the running thread; see current().
+        Outside of any session, the default session is used, which is
+        what the module level API and config.set_* functions work on.
+        Sessions do not share caches or counters with each other. '''
+
+    def __init__(self,
+                 validator=jsonschema.Draft4Validator,
+                 debug=False,
+                 warn_uninhabited=False,
+                 subtype_memo_size=0,
+                 meet_join_cache_size=1024,
+                 anyOf_prune_budget=0,
+                 regex_cache_size=1024,
+                 negation_cache_size=1024,
+                 canonical_cache_size=0):
+        self.VALIDATOR = validator                          # Which schema validator draft to use
+        self.PRINT_DB = debug                               # Print debugging info?
+        self.WARN_UNINHABITED = warn_uninhabited            # Enable uninhabited types warning?
+        self.SUBTYPE_MEMO_SIZE = subtype_memo_size          # Share subtype verdicts across calls? (LRU size, 0 disables)
+        self.MEET_JOIN_CACHE_SIZE = meet_join_cache_size    # Cache meet and join results? (LRU size, 0 disables)
+        self.ANYOF_PRUNE_BUDGET = anyOf_prune_budget        # Drop subsumed anyOf branches? (max subtype checks per anyOf, 0 disables)
+        self.REGEX_CACHE_SIZE = regex_cache_size            # Cache regex automata and inclusions? (LRU size, 0 disables)
+        self.NEGATION_CACHE_SIZE = negation_cache_size      # Cache negations of canonical schemas? (LRU size, 0 disables)
+        self.CANONICAL_CACHE_SIZE = canonical_cache_size    # Cache canonicalized operands? (LRU size, 0 disables)
+        self.counters = collections.Counter()               # Event name -> number of occurrences
+        self.memos = {}                                     # Cache name -> Memo, see _memo.shared_memo
+        self.lock = threading.Lock()
+
+    def settings(self):
+        ''' The settings of this session, without caches and stats. '''
+        return dict((k, v) for k, v in vars(self).items() if k.isupper())
+
+    def configure(self, settings):
+        for k, v in settings.items():
+            setattr(self, k, v)
+
+    def get_stats(self):
+        return dict(self.counters)
+
+    def reset_stats(self):
+        self.counters.clear()
+
+    def clear_caches(self):
+        with self.lock:
+            self.memos.clear()
+
+    @contextlib.contextmanager
+    def activate(self):
+        ''' Make this the current session of the running thread. '''
+        stack = _active.__dict__.setdefault("stack", [])
+        stack.append(self)
+        try:
+            yield self
+        finally:
+            stack.pop()
+
+
+_active = threading.local()
+
+default = Session()
+
+
+def current():
+    ''' The innermost active session of the running thread,
+        or the default session. '''
+    stack = getattr(_active, "stack", None)
+    return stack[-1] if stack else default
@@ -0,0 +1,21 @@
+'''
+Created on October 19, 2026
+'''
+
+from jsonsubschema.session import current
+
+# Counters live in sessions, see jsonsubschema.session.Session.
+
+
+def count(event, n=1):
+    current().counters[event] += n
+
+
+# API to read the counters collected so far
+def get_stats():
+    return current().get_stats()
+
+
+# API to reset all counters
+def reset_stats():
+    current().reset_stats()
@@ -3,6 +3,7 @@ Created on August 9, 2019
 @author: Andrew Habib
 '''
 
+import copy
 import json
 import unittest
 
@@ -107,3 +108,402 @@ class TestAPI(unittest.TestCase):
         
         with self.subTest():
             self.assertEqual(joinSchemas(s2, s2), s2)
+
+    def test_api_canonical_marker(self):
+        s = {"type": "array", "items": {"enum": [1, 2]}}
+        canonical = json.loads(json.dumps(canonicalizeSchema(s)))
+
+        with self.subTest():
+            self.assertTrue(isEquivalent(canonical, s))
+
+        with self.subTest():
+            self.assertTrue(isSubschema(canonical, {"type": "array"}))
+
+        with self.subTest():
+            self.assertFalse(isSubschema({"type": "array"}, canonical))
+
+        # Embedding checkers should not modify the stored canonical schema.
+        with self.subTest():
+            self.assertEqual(canonical, json.loads(
+                json.dumps(canonicalizeSchema(s))))
+
+        # A marker which does not match the content falls back
+        # to full canonicalization.
+        tampered = dict(canonical)
+        tampered["items"] = {"type": "string"}
+        with self.subTest():
+            self.assertTrue(isSubschema(
+                tampered, {"type": "array", "items": {"type": "string"}}))
+
+    def test_subtype_memo(self):
+        item = {"type": "object", "properties": {"a": {"type": "string"}}}
+        item_ = {"type": "object", "properties": {"a": {"type": ["string", "null"]}}}
+        s1 = {"type": "array", "items": item}
+        s2 = {"type": "array", "items": [item_, item_, item_]}
+
+        # Within one call, repeated pairs are looked up by structure.
+        reset_stats()
+        with self.subTest():
+            self.assertTrue(isSubschema(s1, s2))
+            self.assertGreater(get_stats().get("subtype_memo_hits", 0), 0)
+
+        # Across calls, verdicts are shared by structure only if enabled.
+        set_subtype_memo_size(16)
+        try:
+            isSubschema(s1, s2)
+            reset_stats()
+            with self.subTest():
+                self.assertTrue(isSubschema(s1, s2))
+                self.assertFalse(isSubschema({"type": "array"}, s2))
+                self.assertGreater(get_stats()["subtype_memo_hits"], 0)
+        finally:
+            set_subtype_memo_size(0)
+
+    def test_meet_join_cache(self):
+        s = {"type": "string", "minLength": 1}
+        t = {"type": "string", "maxLength": 3}
+
+        meetSchemas(s, t)
+        joinSchemas(s, t)
+        reset_stats()
+        with self.subTest():
+            self.assertEqual(meetSchemas(s, t), meetSchemas(t, s))
+            self.assertTrue(isSubschema(t, joinSchemas(s, t)))
+            self.assertGreater(get_stats()["meet_cache_hits"], 0)
+            self.assertGreater(get_stats()["join_cache_hits"], 0)
+
+        # Cached results are shared, so joining enums must not modify them.
+        b1 = c.JSONTypeBoolean({"enum": [True]})
+        b2 = c.JSONTypeBoolean({"enum": [False]})
+        j = b1.join(b2)
+        with self.subTest():
+            self.assertIs(j, b1.join(b2))
+            self.assertEqual(b1.enum, [True])
+            self.assertEqual(b2.enum, [False])
+
+        # Callers get copies, which they may modify.
+        with self.subTest():
+            m = meetSchemas(s, t)
+            m.pop("type")
+            self.assertEqual(meetSchemas(s, t)["type"], "string")
+            handle = compile(s)
+            self.assertIsNot(meetSchemas(handle, {}), handle.schema)
+            self.assertIsNot(joinSchemas(handle, {"not": {}}), handle.schema)
+
+    def test_anyOf_pruning(self):
+        obj = {"type": "object", "required": ["a"]}
+        s = {"anyOf": [obj, {"type": "integer", "minimum": 0, "maximum": 10},
+                       obj, {"type": "integer", "minimum": 0, "maximum": 20},
+                       {"type": "object", "required": ["a", "b"]}]}
+        t = {"anyOf": [obj, {"type": "integer", "minimum": 0, "maximum": 20}]}
+
+        reset_stats()
+        with self.subTest():
+            self.assertTrue(isEquivalent(s, t))
+            self.assertGreater(get_stats()["anyOf_deduplicated"], 0)
+            self.assertNotIn("anyOf_pruned", get_stats())
+
+        set_anyOf_prune_budget(16)
+        try:
+            with self.subTest():
+                self.assertTrue(isEquivalent(s, t))
+                self.assertEqual(len(api.prepare_operand(s).anyOf), 2)
+                self.assertGreater(get_stats()["anyOf_pruned"], 0)
+        finally:
+            set_anyOf_prune_budget(0)
+
+        # Branches are only pruned where the subtype checks are exact.
+        s = {"anyOf": [{"type": "object", "properties": {"p": {"enum": [True]}}},
+                       {"type": "object", "properties": {"p": {"type": "boolean"}}}]}
+        t = {"type": "object", "properties": {"p": {"enum": [False]}}}
+        with self.subTest():
+            self.assertTrue(isSubschema(t, s))
+            self.assertTrue(Checker(anyOf_prune_budget=16).isSubschema(t, s))
+        s = {"anyOf": [{"type": "object", "additionalProperties": {"type": "integer"}},
+                       {"type": "object", "properties": {"a": {"type": "string"}}}]}
+        t = {"type": "object", "properties": {"a": {"type": "integer"}},
+             "required": ["a"], "additionalProperties": False}
+        with self.subTest():
+            self.assertTrue(isSubschema(t, s))
+            self.assertTrue(Checker(anyOf_prune_budget=64).isSubschema(t, s))
+
+    def test_batch(self):
+        lhs = [{"type": "integer"}, {"type": "string", "maxLength": 3}, {"type": "integer"}]
+        rhs = [{"type": "number"}, {"type": ["string", "null"]}]
+
+        reset_stats()
+        with self.subTest():
+            self.assertEqual(isSubschemaMatrix(lhs, rhs),
+                             [[isSubschema(s1, s2) for s2 in rhs] for s1 in lhs])
+            self.assertEqual(isSubschemaMatrix(lhs, rhs),
+                             [[True, False], [False, True], [True, False]])
+        with self.subTest():
+            pairs = [(s1, s2) for s1 in lhs for s2 in rhs]
+            reset_stats()
+            self.assertEqual(list(isSubschemaPairs(iter(pairs))),
+                             [True, False, False, True, True, False])
+            self.assertEqual(get_stats()["operands_reused"], 12 - 4)
+
+    def test_compiled(self):
+        import pickle
+        contract = {"type": "object", "required": ["a"],
+                    "properties": {"a": {"type": "string", "pattern": "^a+$"}}}
+        s = {"type": "object", "required": ["a", "b"],
+             "properties": {"a": {"type": "string", "enum": ["aa"]}}}
+        c = compile(contract)
+
+        with self.subTest():
+            self.assertTrue(isSubschema(s, c))
+            self.assertFalse(isSubschema(c, s))
+            self.assertTrue(isEquivalent(c, contract))
+            self.assertEqual(meetSchemas(c, s).digest(), meetSchemas(contract, s).digest())
+            self.assertEqual(joinSchemas(s, c).digest(), joinSchemas(s, contract).digest())
+        with self.subTest():
+            with self.assertRaises(AttributeError):
+                c.digest = "x"
+        with self.subTest():
+            c_ = pickle.loads(pickle.dumps(c))
+            self.assertEqual(c, c_)
+            self.assertTrue(isEquivalent(c_, c))
+            self.assertEqual(isSubschemaMatrix([s, c_], [c]), [[True], [True]])
+
+    def test_checker_sessions(self):
+        obj = {"type": "object", "required": ["a"]}
+        s = {"anyOf": [obj, {"type": "object", "required": ["a", "b"]}]}
+
+        c1 = Checker(anyOf_prune_budget=16)
+        c2 = Checker(meet_join_cache_size=0)
+        reset_stats()
+        with self.subTest():
+            self.assertTrue(c1.isEquivalent(s, obj))
+            self.assertTrue(c2.isEquivalent(s, obj))
+            self.assertGreater(c1.get_stats()["anyOf_pruned"], 0)
+            self.assertNotIn("anyOf_pruned", c2.get_stats())
+            self.assertNotIn("anyOf_pruned", get_stats())
+        with self.subTest():
+            t = {"type": "object", "required": ["b"]}
+            c1.meetSchemas(obj, t)
+            c2.meetSchemas(obj, t)
+            self.assertIn("meet_cache", c1.memos)
+            self.assertNotIn("meet_cache", c2.memos)
+        with self.subTest():
+            with c2.activate():
+                set_debug(False)
+                set_anyOf_prune_budget(4)
+            self.assertEqual(c2.ANYOF_PRUNE_BUDGET, 4)
+            self.assertEqual(session.default.ANYOF_PRUNE_BUDGET, 0)
+        with self.subTest():
+            self.assertEqual(list(c1.isSubschemaPairs([(obj, s), (s, obj)])), [True, True])
+            self.assertEqual(c1.compile(s), compile(obj))
+
+    def test_batch_parallel(self):
+        lhs = [{"type": "integer", "minimum": i} for i in range(4)] + [{"type": "string"}]
+        rhs = [{"type": "number", "minimum": i} for i in range(3)]
+
+        with self.subTest():
+            self.assertEqual(isSubschemaMatrix(lhs, rhs, workers=2), isSubschemaMatrix(lhs, rhs))
+        with self.subTest():
+            pairs = [(s2, s1) for s1 in lhs for s2 in rhs]
+            self.assertEqual(list(isSubschemaPairs(pairs, workers=2)),
+                             list(isSubschemaPairs(pairs)))
+        with self.subTest():
+            c = Checker()
+            c.isSubschemaMatrix(lhs, rhs, workers=2)
+            self.assertGreater(c.get_stats().get("sketch_settled", 0), 0)
+
+    def test_async(self):
+        import asyncio
+        import threading
+        from jsonsubschema._checkpoint import cancellable
+        from jsonsubschema.exceptions import Cancelled
+
+        s1 = {"type": "integer"}
+        s2 = {"type": ["number", "string"]}
+        loop = asyncio.new_event_loop()
+        try:
+            with self.subTest():
+                self.assertTrue(loop.run_until_complete(aisSubschema(s1, s2)))
+                self.assertFalse(loop.run_until_complete(aisEquivalent(s1, s2)))
+                self.assertEqual(loop.run_until_complete(ameet(s1, s2)).digest(),
+                                 meetSchemas(s1, s2).digest())
+                self.assertEqual(loop.run_until_complete(ajoin(s1, s2)).digest(),
+                                 joinSchemas(s1, s2).digest())
+            with self.subTest():
+                task = loop.create_task(aisSubschema(s1, s2))
+                loop.call_soon(task.cancel)
+                with self.assertRaises(asyncio.CancelledError):
+                    loop.run_until_complete(task)
+        finally:
+            loop.close()
+
+        with self.subTest():
+            cancelled = threading.Event()
+            cancelled.set()
+            with self.assertRaises(Cancelled):
+                with cancellable(cancelled):
+                    isSubschema(s1, s2)
+            self.assertTrue(isSubschema(s1, s2))
+
+    def test_async_cancel_running(self):
+        import asyncio
+        import concurrent.futures
+
+        # Takes far longer than the test may wait to canonicalize,
+        # unless the check is cancelled.
+        slow = {"oneOf": [{"type": "integer", "minimum": i, "maximum": i + 5} for i in range(1000)]}
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+
+        async def cancel_running():
+            task = asyncio.ensure_future(aisSubschema(slow, {"type": "integer"}, executor=executor))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # The only thread of the executor is free again for the next job.
+            probe = asyncio.get_running_loop().run_in_executor(executor, lambda: "next")
+            return await asyncio.wait_for(probe, 60)
+
+        loop = asyncio.new_event_loop()
+        try:
+            with self.subTest():
+                self.assertEqual(loop.run_until_complete(cancel_running()), "next")
+            with self.subTest():
+                with concurrent.futures.ProcessPoolExecutor(1) as processes:
+                    with self.assertRaises(TypeError):
+                        loop.run_until_complete(aisSubschema(slow, slow, executor=processes))
+        finally:
+            loop.close()
+            executor.shutdown()
+
+    def test_limits(self):
+        s1 = {"type": "integer", "minimum": 0, "maximum": 10}
+        s2 = {"anyOf": [{"type": "integer", "minimum": 5},
+                        {"type": "integer", "maximum": 4}]}
+        with self.subTest():
+            reset_stats()
+            ret = isSubschema(s1, s2, max_nodes=3)
+            self.assertIsInstance(ret, Unknown)
+            self.assertEqual(ret, Unknown("max_nodes"))
+            self.assertFalse(ret)
+            self.assertEqual(get_stats()["limit_exceeded"], 1)
+        with self.subTest():
+            a1 = {"type": "array", "items": s1}
+            a2 = {"type": "array", "items": s2}
+            self.assertEqual(isSubschema(a1, a2, max_depth=0), Unknown("max_depth"))
+            self.assertEqual(meetSchemas(a1, a2, max_depth=0), Unknown("max_depth"))
+            self.assertIs(isSubschema(a1, a2, max_depth=3), True)
+        with self.subTest():
+            self.assertEqual(isEquivalent(s1, s2, timeout=0), Unknown("timeout"))
+        with self.subTest():
+            # Limits which are not hit don't change the verdict.
+            self.assertIs(isSubschema(s1, {"type": "number"}, timeout=60, max_nodes=10**6, max_depth=100), True)
+            self.assertIs(isSubschema(s1, s2, timeout=60), True)
+
+    def test_compare(self):
+        s1 = {"type": "integer"}
+        s2 = {"type": ["number", "string"]}
+        s3 = {"type": "string"}
+        with self.subTest():
+            self.assertEqual(compare(s1, s2), "sub")
+            self.assertEqual(compare(s2, s1), "super")
+            self.assertEqual(compare(s1, s3), "incomparable")
+            self.assertEqual(compare(s2, {"anyOf": [s3, {"type": "number"}]}), "equal")
+        with self.subTest():
+            reset_stats()
+            self.assertTrue(isEquivalent(s2, {"type": ["string", "number"]}))
+            self.assertGreater(get_stats()["identical_pairs"], 0)
+        with self.subTest():
+            self.assertEqual(compare(s1, s2, timeout=0), Unknown("timeout"))
+
+    def test_schema_history(self):
+        v1 = {"type": "object",
+              "properties": {"a": {"type": "array", "items": {"type": "string", "pattern": "^a+$"}},
+                             "b": {"type": "integer"}}}
+        v2 = copy.deepcopy(v1)
+        v2["properties"]["b"] = {"type": "number"}
+        v3 = copy.deepcopy(v2)
+        v3["properties"]["b"] = {"type": "integer", "minimum": 0}
+        history = SchemaHistory([v1])
+        with self.subTest():
+            self.assertEqual(history.check(v2), ["sub"])
+            self.assertEqual(len(history.versions), 2)
+        with self.subTest():
+            # Unchanged subtrees are not descended into.
+            reset_stats()
+            self.assertEqual(history.check(v3, k=2, add=False), ["super", "super"])
+            self.assertEqual(len(history.versions), 2)
+            self.assertGreater(get_stats()["identical_pairs"], 0)
+        with self.subTest():
+            # Pairs checked before are not checked again.
+            reset_stats()
+            self.assertEqual(history.check(v3, k=2), ["super", "super"])
+            self.assertEqual(len(history.versions), 3)
+            self.assertGreater(get_stats()["subtype_memo_hits"], 0)
+
+    def test_schema_index(self):
+        index = SchemaIndex({
+            "int": {"type": "integer"},
+            "num": {"type": "number"},
+            "str": {"type": "string"},
+            "num_or_str": {"type": ["number", "string"]},
+            "obj_a": {"type": "object", "required": ["a"]},
+            "obj_ab": {"type": "object", "required": ["a", "b"]},
+            "any": {}})
+        with self.subTest():
+            self.assertEqual(index.supertypes_of({"type": "integer", "minimum": 0}),
+                             ["int", "num", "num_or_str", "any"])
+            self.assertEqual(index.subtypes_of({"type": "number"}), ["int", "num"])
+            self.assertEqual(index.subtypes_of({"type": "object", "required": ["b"]}), ["obj_ab"])
+        with self.subTest():
+            # Schemas of other types, or missing required keys,
+            # are never checked for real.
+            reset_stats()
+            self.assertEqual(index.supertypes_of({"type": "object", "required": ["a", "c"]}),
+                             ["obj_a", "any"])
+            self.assertLessEqual(get_stats()["index_checks"], 2)
+        with self.subTest():
+            index.delete("any")
+            index.insert("int", {"type": "integer", "maximum": 10})
+            self.assertNotIn("any", index)
+            self.assertEqual(len(index), 6)
+            self.assertEqual(index.supertypes_of({"type": "integer", "minimum": 0}),
+                             ["num", "num_or_str"])
+            self.assertEqual(index.subtypes_of({"type": "integer"}), ["int"])
+
+    def test_schema_index_closed(self):
+        closed_ab = {"type": "object", "additionalProperties": False,
+                     "properties": {"a": {"type": "string"}, "b": {}}}
+        index = SchemaIndex({"closed_ab": closed_ab, "any": {}})
+        queries = [
+            ({"type": "object", "additionalProperties": False,
+              "properties": {"a": {"type": "string"}}}, ["closed_ab", "any"]),
+            ({"type": "object", "properties": {"a": {"type": "string"}}}, ["any"]),
+            ({"type": "object", "additionalProperties": False,
+              "properties": {"a": {}, "c": {}}}, ["any"]),
+            ({"type": "object", "maxProperties": 0}, ["closed_ab", "any"])]
+        for q, expected in queries:
+            with self.subTest(q=q):
+                self.assertEqual(isSubschema(q, closed_ab), "closed_ab" in expected)
+                self.assertEqual(index.supertypes_of(q), expected)
+        with self.subTest():
+            # Open queries never reach the check of closed candidates.
+            reset_stats()
+            self.assertEqual(index.supertypes_of({"type": "object"}), ["any"])
+            self.assertLessEqual(get_stats()["index_checks"], 1)
+
+    def test_schema_index_uninhabited(self):
+        bad = {"type": "object", "required": ["a"], "additionalProperties": False}
+        index = SchemaIndex({
+            "bad": bad,
+            "q": {"type": "object", "required": ["b"]},
+            "str": {"type": "string"}})
+        with self.subTest():
+            self.assertTrue(isSubschema(bad, {"type": "object", "required": ["b"]}))
+            self.assertEqual(index.subtypes_of({"type": "object", "required": ["b"]}), ["bad", "q"])
+            self.assertEqual(index.subtypes_of({"type": "string"}), ["bad", "str"])
+        with self.subTest():
+            self.assertEqual(index.supertypes_of(bad), ["bad", "q", "str"])
+            self.assertEqual(index.supertypes_of({"type": "string"}), ["str"])
+        with self.subTest():
+            index.delete("bad")
+            self.assertEqual(index.subtypes_of({"type": "string"}), ["str"])
@@ -5,7 +5,8 @@ Created on June 3, 2019
 
 import unittest
 
-from jsonsubschema import isSubschema, set_warn_uninhabited
+import jsonsubschema._checkers as c
+from jsonsubschema import isSubschema, isEquivalent, meetSchemas, set_warn_uninhabited, get_stats, reset_stats
 
 
 class TestMixedTypes(unittest.TestCase):
@@ -161,6 +162,60 @@ class TestMixedTypes(unittest.TestCase):
         with self.subTest():
             self.assertFalse(isSubschema(s2, s1))
 
+    def test_identical_pairs(self):
+        item = {'type': 'object', 'properties': {'a': {'type': 'string', 'pattern': '^a+$'}}}
+        s1 = {'type': 'array', 'items': item, 'maxItems': 3}
+        s2 = {'type': 'array', 'items': item}
+
+        with self.subTest():
+            reset_stats()
+            self.assertTrue(isSubschema(s1, s2))
+            self.assertGreater(get_stats()['identical_pairs'], 0)
+        with self.subTest():
+            reset_stats()
+            meetSchemas(s1, s2)
+            self.assertGreater(get_stats()['identical_pairs'], 0)
+        with self.subTest():
+            self.assertTrue(isSubschema(item, {'anyOf': [{'type': 'string'}, item]}))
+
+    def test_sketch_settled(self):
+        s1 = {'type': 'object', 'required': ['a'], 'properties': {'a': {'type': 'string'}}}
+        s2 = {'type': 'object', 'required': ['a', 'b']}
+        s3 = {'type': ['object', 'null']}
+
+        with self.subTest():
+            reset_stats()
+            self.assertFalse(isSubschema(s1, s2))
+            self.assertGreater(get_stats()['sketch_settled'], 0)
+        with self.subTest():
+            reset_stats()
+            self.assertFalse(isSubschema(s3, s1))
+            self.assertGreater(get_stats()['sketch_settled'], 0)
+        with self.subTest():
+            # Sketches only ever settle negative verdicts.
+            reset_stats()
+            self.assertTrue(isSubschema(s2, s3))
+            self.assertNotIn('sketch_settled', get_stats())
+        with self.subTest():
+            reset_stats()
+            self.assertEqual(meetSchemas(s3, {'type': 'string'}), {'not': {}})
+            self.assertGreater(get_stats()['sketch_settled'], 0)
+
+    def test_meet_dict_view(self):
+        ''' Meet results are valid schemas of their own. '''
+        s1 = {'allOf': [{'not': {'type': 'integer'}},
+                        {'type': 'object', 'properties': {'kind': {'type': 'integer', 'multipleOf': 3}}}]}
+        s2 = {'type': 'array', 'items': {'type': 'string', 'maxLength': 3}, 'minItems': 1}
+        s3 = {'type': 'array', 'items': [{'type': 'string', 'minLength': 1}], 'additionalItems': False}
+        s4 = {'type': 'object', 'patternProperties': {'^a': {'type': 'integer'}}, 'required': ['x']}
+        s5 = {'type': 'object', 'patternProperties': {'b$': {'type': 'string'}}, 'additionalProperties': False}
+        with self.subTest():
+            self.assertTrue(isEquivalent(meetSchemas(s1, s1), s1))
+        with self.subTest():
+            self.assertTrue(isEquivalent(meetSchemas(s2, s3), {'allOf': [s2, s3]}))
+        with self.subTest():
+            self.assertTrue(isEquivalent(meetSchemas(s4, s5), {'allOf': [s4, s5]}))
+
 
 class TestBottomAndTop(unittest.TestCase):
 
@@ -199,3 +254,110 @@ class TestBottomAndTop(unittest.TestCase):
             self.assertTrue(isSubschema(s1, s2))
         with self.subTest():
             self.assertTrue(isSubschema(s2, s1))
+
+    def test_nested_allOf(self):
+        s1 = {'type': 'object',
+              'properties': {'p': {'allOf': [{'type': 'object', 'required': ['x']},
+                                             {'type': 'object', 'properties': {'y': {'type': 'string'}}}]}}}
+        s2 = {'type': 'object',
+              'properties': {'p': {'type': 'object', 'required': ['x']}}}
+
+        with self.subTest():
+            self.assertTrue(isSubschema(s1, s2))
+        with self.subTest():
+            self.assertFalse(isSubschema(s2, s1))
+
+    def test_anyOf_buckets(self):
+        ints = [{'type': 'integer', 'minimum': i, 'maximum': i} for i in range(20)]
+        strs = [{'type': 'string', 'pattern': '^k' + str(i) + '$'} for i in range(5)]
+        s1 = {'anyOf': list(reversed(ints)) + strs + [{'type': 'null'}] * 3}
+        s2 = {'anyOf': [{'type': 'integer', 'minimum': 0, 'maximum': 19},
+                        {'type': 'string', 'pattern': '^k[0-4]$'},
+                        {'type': 'null'}]}
+
+        with self.subTest():
+            self.assertTrue(isSubschema(s1, s2))
+        with self.subTest():
+            self.assertTrue(isSubschema(s2, s1))
+        with self.subTest():
+            self.assertFalse(isSubschema(s1, {'anyOf': ints[1:] + strs + [{'type': 'null'}]}))
+
+    def test_anyOf_rhs_types(self):
+        s1 = {'anyOf': [{'type': 'integer', 'minimum': 1}, {'type': 'number', 'multipleOf': 2},
+                        {'type': 'string'}]}
+        s2 = {'anyOf': [{'type': 'object'}, {'type': 'string'}, {'type': 'array'},
+                        {'type': 'integer'}, {'type': 'null'}]}
+        s3 = {'anyOf': [{'type': 'object'}, {'type': 'string'}, {'type': 'number'}]}
+
+        with self.subTest():
+            self.assertTrue(isSubschema(s1, s2))
+        with self.subTest():
+            self.assertFalse(isSubschema(s2, s1))
+        with self.subTest():
+            self.assertTrue(isSubschema(s1, s3))
+        with self.subTest():
+            self.assertFalse(isSubschema(s3, s2))
+
+    def test_anyOf_rhs_types_threads(self):
+        ''' Threads sharing one anyOf node never see a partial type index. '''
+        import sys
+        import threading
+
+        branches = [c.JSONTypeObject({'required': ['k%d' % i]}) for i in range(3000)]
+        lhs = [c.JSONTypeObject({'required': ['k%d' % i, 'x']}) for i in range(0, 3000, 300)]
+        verdicts = []
+
+        def check(s1, s2, barrier):
+            barrier.wait()
+            verdicts.append(s1.isSubtype(s2))
+
+        # Switch threads often, to interleave them within index building.
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for _ in range(4):
+                s2 = c.JSONanyOf({'anyOf': branches})
+                barrier = threading.Barrier(len(lhs))
+                threads = [threading.Thread(target=check, args=(s1, s2, barrier)) for s1 in lhs]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(verdicts, [True] * len(verdicts))
+        self.assertEqual(len(verdicts), 4 * len(lhs))
+
+    def test_allOf_disjoint(self):
+        s1 = {'allOf': [{'type': 'object', 'required': ['a']},
+                        {'type': ['string', 'object'], 'pattern': '^a+$'},
+                        {'type': 'string'}]}
+        s2 = {'allOf': [{'type': 'number', 'minimum': 1}, {'type': 'integer'}]}
+        s3 = {'allOf': [{'type': 'integer', 'minimum': i} for i in range(40)]}
+
+        reset_stats()
+        with self.subTest():
+            self.assertTrue(isSubschema(s1, {'not': {}}))
+            self.assertGreater(get_stats()["allOf_disjoint"], 0)
+        with self.subTest():
+            self.assertTrue(isEquivalent(s2, {'type': 'integer', 'minimum': 1}))
+        with self.subTest():
+            self.assertTrue(isEquivalent(s3, {'type': 'integer', 'minimum': 39}))
+
+    def test_top_bot_singletons(self):
+        import copy
+        import pickle
+
+        for node in [c.JSONtop(), c.JSONbot()]:
+            with self.subTest(node=node):
+                self.assertIs(node, type(node)())
+                self.assertIs(node, copy.deepcopy(node))
+                self.assertIs(node, pickle.loads(pickle.dumps(node)))
+
+        with self.subTest():
+            self.assertTrue(c.is_top(True) and c.is_top({}) and c.is_top(c.JSONtop()))
+            self.assertFalse(c.is_top(False) or c.is_top(c.JSONTypeNull({})))
+
+        with self.subTest():
+            self.assertTrue(c.is_bot(False) and c.is_bot({'not': {}}) and c.is_bot(c.JSONbot()))
+            self.assertFalse(c.is_bot(True) or c.is_bot(c.JSONTypeNull({})))
@@ -6,7 +6,10 @@ Created on July 25, 2019
 import copy
 import unittest
 
-from jsonsubschema import isSubschema
+import jsonsubschema._checkers as c
+import jsonsubschema._utils as utils
+import jsonsubschema.api as api
+from jsonsubschema import isSubschema, get_stats, reset_stats
 
 
 class TestObjectSubtype(unittest.TestCase):
@@ -551,6 +554,85 @@ class TestObjectSubtype(unittest.TestCase):
         with self.subTest():
             self.assertFalse(isSubschema(s2, s1))
 
+    def test_pattern_inclusions(self):
+        s1 = {'type': 'object',
+              'patternProperties': {'^a%d[0-9]+$' % i: {'type': 'integer'} for i in range(5)}}
+        s2 = {'type': 'object',
+              'patternProperties': {'^a%d[0-5]+$' % i: {'type': 'number'} for i in range(5)}}
+        patterns = ['a[0-9]+', 'a1[0-9]*', 'a', '[a-z]+', 'ab?c', 'a.*', '(ab)*', '.*']
+
+        with self.subTest():
+            self.assertTrue(isSubschema(s1, s2))
+        with self.subTest():
+            self.assertFalse(isSubschema(s2, s1))
+        with self.subTest():
+            self.assertEqual(utils.regex_inclusions(tuple(patterns[:5]), tuple(patterns[2:])),
+                             set((p1, p2) for p1 in patterns[:5] for p2 in patterns[2:]
+                                 if utils.regex_isSubset(p1, p2)))
+
+    def test_uninhabited_cache(self):
+        s = c.JSONTypeObject({'required': ['a']})
+        reset_stats()
+
+        # The verdict is computed once at construction.
+        with self.subTest():
+            self.assertFalse(s.isUninhabited())
+            self.assertFalse(s.isUninhabited())
+            self.assertEqual(get_stats().get('uninhabited_computed', 0), 0)
+
+        # and recomputed only after the internal state changes.
+        s.maxProperties = 0
+        s.updateInternalState()
+        with self.subTest():
+            self.assertTrue(s.isUninhabited())
+            self.assertTrue(s.isUninhabited())
+            self.assertEqual(get_stats()['uninhabited_computed'], 1)
+
+    def test_object_key_index(self):
+        s = api.prepare_operand({'type': 'object',
+                                 'properties': {'a': {'type': 'string'}},
+                                 'patternProperties': {'^x': {'type': 'integer'},
+                                                       'y$': {'type': 'number'}},
+                                 'additionalProperties': False,
+                                 'required': ['a', 'xy']})
+
+        with self.subTest():
+            self.assertEqual(s.propertyNames(), frozenset(['a']))
+            self.assertEqual(s.requiredKeys(), frozenset(['a', 'xy']))
+        with self.subTest():
+            self.assertEqual([i.type for i in s.schemasForKey('a')], ['string'])
+            self.assertEqual(sorted(i.type for i in s.schemasForKey('xy')), ['integer', 'number'])
+            self.assertEqual(s.schemasForKey('z'), [False])
+        with self.subTest():
+            self.assertTrue(isSubschema(s, {'type': 'object', 'required': ['xy'],
+                                            'properties': {'xy': {'type': 'number'}}}))
+
+    def test_discriminator(self):
+        def variant(kind, a_min=0):
+            return {'type': 'object', 'required': ['kind', 'a'],
+                    'properties': {'kind': {'enum': [kind]},
+                                   'a': {'type': 'integer', 'minimum': a_min}}}
+
+        s1 = {'anyOf': [variant(k, 1) for k in ['x', 'y', 'z']]}
+        s2 = {'anyOf': [variant(k) for k in ['x', 'y', 'z', 'w']]}
+        s3 = {'anyOf': [variant(k) for k in ['x', 'y']] + [{'type': 'object'}]}
+
+        reset_stats()
+        with self.subTest():
+            self.assertTrue(isSubschema(s1, s2))
+            self.assertGreater(get_stats()['discriminator_lookups'], 0)
+        with self.subTest():
+            self.assertFalse(isSubschema(s2, s1))
+        with self.subTest():
+            self.assertTrue(isSubschema(s1, s3))
+        with self.subTest():
+            self.assertFalse(api.prepare_operand(s3).discriminator())
+        with self.subTest():
+            k, variants = api.prepare_operand(s2).discriminator()
+            self.assertEqual(k, 'kind')
+            self.assertEqual(len(variants[('string', 'w')]), 1)
+
+
 class TestDependency(unittest.TestCase):
 
     def test_1(self):